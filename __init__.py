@@ -73,6 +73,30 @@ class MolPrintSettings(PropertyGroup):
         description="Number of circle division for objects. Large numbers slow things down!",
         default=24,
     )
+    lod = BoolProperty(
+        name="Adaptive detail",
+        description="Fewer divisions for small atoms and thin bonds, up to the primitive detail",
+        default=False,
+    )
+    chord_error = FloatProperty(
+        name="Chord error",
+        description="Largest gap in mm between a printed atom or bond and its polygons",
+        default=0.05,
+        precision=3,
+        min=0.001, max=1.0,
+    )
+    print_scale = FloatProperty(
+        name="Print scale",
+        description="Printed mm per imported unit (Angstrom)",
+        default=10.0,
+        precision=2,
+        min=0.1, max=100.0,
+    )
+    merge_split = BoolProperty(
+        name="Merge split bonds",
+        description="Clean joins the two halves PyMOL splits each bond into, turn off if a merge goes wrong",
+        default=True,
+    )
     strut_radius = FloatProperty(
         name="Strut radius",
         description="Radius of added struts",
@@ -401,6 +425,7 @@ classes = (
     operators.MolPrintMakeDouble,
     operators.MolPrintPIP,
     operators.MolPrintShowConnectivity,
+    operators.MolPrintSplitPrimitives,
     MolPrintSettings,
     printerpreferences,
 )
@@ -0,0 +1,53 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8-80 compliant>
+
+# Plain python geometry for mesh_helpers. This should work without a blender
+# at all, points and vectors are any 3 float sequences (tuples or Vectors).
+
+import math
+
+# Split cylinder matching, see split_cylinder_joint()
+SPLIT_CAP_DISTANCE = 0.01  # same as mesh_helpers.tol()
+SPLIT_RADIUS_DIFFERENCE = 0.01
+SPLIT_AXIS_COS = 0.999  # parallel or anti-parallel to within ~2.5 degrees
+
+
+def dot(v1, v2):
+    return v1[0] * v2[0] + v1[1] * v2[1] + v1[2] * v2[2]
+
+
+def distance(p1, p2):
+    return math.sqrt(sum((a - b) ** 2 for a, b in zip(p1, p2)))
+
+
+def split_cylinder_joint(caps1, axis1, radius1, caps2, axis2, radius2):
+    '''Where two cylinders meet if they are the halves of one split bond, else
+    None. Halves have the same radius, parallel axes in either direction and
+    a cap of each at the same place. caps are the (top, bottom) centers and
+    axis the unit axis in world space, as mesh_helpers.cylinder_caps() gives'''
+    if abs(radius1 - radius2) > SPLIT_RADIUS_DIFFERENCE:
+        return None
+    if abs(dot(axis1, axis2)) < SPLIT_AXIS_COS:
+        return None
+    for c1 in caps1:
+        for c2 in caps2:
+            if distance(c1, c2) < SPLIT_CAP_DISTANCE:
+                return tuple((a + b) / 2 for a, b in zip(c1, c2))
+    return None
@@ -22,16 +22,25 @@ DEBUG = False
 
 # This should work without a blender at all
 import os
+import re
+import sys
+import itertools
+import json
+import time
 import shlex
 import math
 
-from math import sin, cos, pi
+from array import array
+from functools import partial
+from math import sin, cos, acos, pi, ceil
 
 texture_cache = {}
 material_cache = {}
 
 EPSILON = 0.0000001  # Very crude.
 
+int_auto = partial(int, base=0)  # x3d ints may be hex
+
 
 def imageConvertCompat(path):
 
@@ -102,265 +111,350 @@ def vrml_split_fields(value):
     return field_list
 
 
-def vrmlFormat(data):
-    """
-    Keep this as a valid vrml file, but format in a way we can predict.
-    """
-    # Strip all commends - # not in strings - warning multiline strings are ignored.
-    def strip_comment(l):
-        #l = ' '.join(l.split())
-        l = l.strip()
+# One token per match: a quoted string (may span lines), a comment, a run of plain
+# words and commas, a bracket or a line ending. A lone quote is an unterminated string.
+VRML_TOKEN_RE = re.compile(r'"[^"]*"|#[^\n]*|[^"#{}\[\]\n]+|[{}\[\]\n]|"')
+VRML_SPACE_RE = re.compile(r'\s+')
 
-        if l.startswith('#'):
-            return ''
 
-        i = l.find('#')
+def vrml_segment_lines(segment):
+    # We need to write one property (field) per line only, otherwise we fail later to detect correctly new nodes.
+    # See T45195 for details.
+    for value in vrml_split_fields(segment):
+        line = ' '.join(value)
+        if '\n' in line:
+            # multiline string, keep its lines apart as vrmlNode.parse() joins them again
+            for l in line.split('\n'):
+                l = ' '.join(l.split())
+                if l:
+                    yield l
+        else:
+            yield line
 
-        if i == -1:
-            return l
 
-        # Most cases accounted for! if we have a comment at the end of the line do this...
-        #j = l.find('url "')
-        j = l.find('"')
+def vrml_tokenize(data):
+    """
+    Single pass over the vrml text, yields the normalized lines vrmlNode.parse()
+    expects: brackets on their own line, one field per line, comments removed,
+    whitespace collapsed and commas separated by spaces.
+    data is the text, or an iterable of text chunks (see vrmlReadChunks()).
+    """
+    if isinstance(data, str):
+        data = (data,)
+
+    segment = []  # tokens of the current line
+    glue_end = -1  # end of the last word/string, tokens touching it are merged
+    pending = ''  # token that may continue in the next chunk
+
+    for chunk in itertools.chain(data, (None,)):
+        final = chunk is None
+        text = pending if final else pending + chunk
+        size = len(text)
+        pending = ''
+
+        for m in VRML_TOKEN_RE.finditer(text):
+            tok = m.group()
+            c = tok[0]
+
+            if not final and (tok == '"' or (m.end() == size and c not in '"{}[]\n')):
+                # A string without its closing quote yet, or a word or comment cut
+                # by the chunk end, start the next chunk with it
+                pending = text[m.start():]
+                size = m.start()
+                break
 
-        if j == -1:  # simple no strings
-            return l[:i].strip()
+            if c == '#':
+                continue
+
+            if c == '\n' or c in '{}[]':
+                if segment:
+                    yield from vrml_segment_lines(segment)
+                    segment = []
+                if c != '\n':
+                    yield c
+                glue_end = -1
+                continue
 
-        q = False
-        for i, c in enumerate(l):
             if c == '"':
-                q = not q  # invert
+                if '\n' not in tok:
+                    tok = VRML_SPACE_RE.sub(' ', tok)
+                if m.start() == glue_end:
+                    segment[-1] += tok  # eg: url"foo.png"
+                else:
+                    segment.append(tok)
+                glue_end = m.end()
+                continue
 
-            elif c == '#':
-                if q is False:
-                    return l[:i - 1]
+            # commas are words of their own, as in eg: point [ 0 0 0,1 0 0 ]
+            words = tok.replace(',', ' , ').split() if ',' in tok else tok.split()
+            if words:
+                if m.start() == glue_end and not (c.isspace() or c == ','):
+                    segment[-1] += words.pop(0)
+                segment.extend(words)
+                glue_end = -1 if (tok[-1].isspace() or tok[-1] == ',') else m.end()
+            else:
+                glue_end = -1
 
-        return l
+        # positions start again from the next text
+        if glue_end != -1:
+            glue_end -= size
 
-    data = '\n'.join([strip_comment(l) for l in data.split('\n')])  # remove all whitespace
+    if segment:
+        yield from vrml_segment_lines(segment)
 
-    EXTRACT_STRINGS = True  # only needed when strings or filesnames containe ,[]{} chars :/
 
-    if EXTRACT_STRINGS:
+def vrmlFormat(data):
+    """
+    Keep this as a valid vrml file, but format in a way we can predict.
+    """
+    return list(vrml_tokenize(data))
 
-        # We need this so we can detect URL's
-        data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
+NODE_NORMAL = 1  # {}
+NODE_ARRAY = 2  # []
+NODE_REFERENCE = 3  # USE foobar
+# NODE_PROTO = 4 #
 
-        string_ls = []
 
-        #search = 'url "'
-        search = '"'
+def vrml_number_array(words, parse_int=int):
+    """
+    Parse number words into a flat typed array, 'i' when they are all ints and 'f' otherwise.
+    Returns None when they are not all numbers.
+    Typed arrays go through foreach_set as a buffer without per item conversion.
+    """
+    try:
+        return array('i', map(parse_int, words))
+    except OverflowError:
+        # 32bit RGBA pixels of a PixelTexture, keep python ints
+        return list(map(parse_int, words))
+    except ValueError:
+        pass
 
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search, last_i)
-            if i != -1:
+    try:
+        return array('f', map(float, words))
+    except (ValueError, OverflowError):
+        return None
 
-                start = i + len(search)  # first char after end of search
-                end = data.find('"', start)
-                if end != -1:
-                    item = data[start:end]
-                    string_ls.append(item)
-                    data = data[:start] + data[end:]
-                    ok = True  # keep looking
 
-                    last_i = (end - len(item)) + 1
-                    # print(last_i, item, '|' + data[last_i] + '|')
+def vrml_array_extend(array_data, values):
+    """
+    Append values to array_data and return it, promoting ints to floats when a row has both.
+    Anything that is not a typed array (strings that failed to parse) ends up in a plain list.
+    """
+    if not array_data:
+        return values
 
-    # done with messy extracting strings part
+    if type(array_data) is array and type(values) is array:
+        if array_data.typecode != values.typecode:
+            if array_data.typecode == 'i':
+                array_data = array('f', array_data)
+            else:
+                values = array('f', values)
+    elif type(array_data) is not list:
+        array_data = list(array_data)
 
-    # Bad, dont take strings into account
-    '''
-    data = data.replace('#', '\n#')
-    data = '\n'.join([ll for l in data.split('\n') for ll in (l.strip(),) if not ll.startswith('#')]) # remove all whitespace
-    '''
-    data = data.replace('{', '\n{\n')
-    data = data.replace('}', '\n}\n')
-    data = data.replace('[', '\n[\n')
-    data = data.replace(']', '\n]\n')
-    data = data.replace(',', ' , ')  # make sure comma's separate
+    array_data.extend(values)
+    return array_data
 
-    # We need to write one property (field) per line only, otherwise we fail later to detect correctly new nodes.
-    # See T45195 for details.
-    data = '\n'.join([' '.join(value) for l in data.split('\n') for value in vrml_split_fields(l.split())])
 
-    if EXTRACT_STRINGS:
-        # add strings back in
+def vrml_float_array(values):
+    """
+    Coordinates as a flat 'f' array, integer only point data parses as 'i'.
+    """
+    if type(values) is array and values.typecode == 'f':
+        return values
+    return array('f', values)
 
-        search = '"'  # fill in these empty strings
 
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search + '"', last_i)
-            # print(i)
-            if i != -1:
-                start = i + len(search)  # first char after end of search
-                item = string_ls.pop(0)
-                # print(item)
-                data = data[:start] + item + data[start:]
-
-                last_i = start + len(item) + 1
+def flip(r, ccw):
+    return r if ccw else r[::-1]
 
-                ok = True
 
-    # More annoying obscure cases where USE or DEF are placed on a newline
-    # data = data.replace('\nDEF ', ' DEF ')
-    # data = data.replace('\nUSE ', ' USE ')
+def vrml_index_faces(points, index, ccw):
+    """
+    Split a -1 separated coordIndex into faces.
+    When the points are many more than the index uses (a Coordinate node shared
+    by several IndexedFaceSets), only the used points are kept.
+    Returns the flat float points, the faces and the new to old vertex map
+    (None when not culled).
+    """
+    points = vrml_float_array(points)
 
-    data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
+    if len(points) >= 6 * len(index):  # Need to cull
+        culled_points = array('f')
+        cull = {}  # Maps old vertex indices to new ones
+        uncull = []  # Maps new indices to the old ones
+        new_index = 0
+    else:
+        uncull = cull = None
 
-    # Better to parse the file accounting for multiline arrays
-    '''
-    data = data.replace(',\n', ' , ') # remove line endings with commas
-    data = data.replace(']', '\n]\n') # very very annoying - but some comma's are at the end of the list, must run this again.
-    '''
+    faces = []
+    face = []
+    # Generate faces. Cull the vertices if necessary,
+    for i in index:
+        if i == -1:
+            if face:
+                faces.append(flip(face, ccw))
+            face = []
+        else:
+            if cull is not None:
+                if not(i in cull):
+                    culled_points.extend(points[3 * i:3 * i + 3])
+                    cull[i] = new_index
+                    uncull.append(i)
+                    i = new_index
+                    new_index += 1
+                else:
+                    i = cull[i]
+            face.append(i)
+    if face:
+        faces.append(flip(face, ccw))  # The last face
 
-    return [l for l in data.split('\n') if l]
+    if cull:
+        points = culled_points
 
-NODE_NORMAL = 1  # {}
-NODE_ARRAY = 2  # []
-NODE_REFERENCE = 3  # USE foobar
-# NODE_PROTO = 4 #
+    return points, faces, uncull
 
-lines = []
 
+class vrmlParser(object):
+    """
+    Owns the formatted lines of a single file, so several files can be parsed at once.
+    Nodes are handed the parser and a line index, they return the index after their end.
+    """
+    __slots__ = ('lines',)
 
-def getNodePreText(i, words):
-    # print(lines[i])
-    use_node = False
-    while len(words) < 5:
+    def __init__(self, lines):
+        self.lines = lines
 
-        if i >= len(lines):
-            break
-            '''
-        elif lines[i].startswith('PROTO'):
-            return NODE_PROTO, i+1
-            '''
-        elif lines[i] == '{':
-            # words.append(lines[i]) # no need
-            # print("OK")
-            return NODE_NORMAL, i + 1
-        elif lines[i].count('"') % 2 != 0:  # odd number of quotes? - part of a string.
-            # print('ISSTRING')
-            break
-        else:
-            new_words = lines[i].split()
-            if 'USE' in new_words:
-                use_node = True
+    def getNodePreText(self, i, words):
+        # print(self.lines[i])
+        use_node = False
+        while len(words) < 5:
 
-            words.extend(new_words)
-            i += 1
+            if i >= len(self.lines):
+                break
+                '''
+            elif self.lines[i].startswith('PROTO'):
+                return NODE_PROTO, i+1
+                '''
+            elif self.lines[i] == '{':
+                # words.append(self.lines[i]) # no need
+                # print("OK")
+                return NODE_NORMAL, i + 1
+            elif self.lines[i].count('"') % 2 != 0:  # odd number of quotes? - part of a string.
+                # print('ISSTRING')
+                break
+            else:
+                new_words = self.lines[i].split()
+                if 'USE' in new_words:
+                    use_node = True
 
-        # Check for USE node - no {
-        # USE #id - should always be on the same line.
-        if use_node:
-            # print('LINE', i, words[:words.index('USE')+2])
-            words[:] = words[:words.index('USE') + 2]
-            if lines[i] == '{' and lines[i + 1] == '}':
-                # USE sometimes has {} after it anyway
-                i += 2
-            return NODE_REFERENCE, i
+                words.extend(new_words)
+                i += 1
 
-    # print("error value!!!", words)
-    return 0, -1
+            # Check for USE node - no {
+            # USE #id - should always be on the same line.
+            if use_node:
+                # print('LINE', i, words[:words.index('USE')+2])
+                words[:] = words[:words.index('USE') + 2]
+                if self.lines[i] == '{' and self.lines[i + 1] == '}':
+                    # USE sometimes has {} after it anyway
+                    i += 2
+                return NODE_REFERENCE, i
 
+        # print("error value!!!", words)
+        return 0, -1
 
-def is_nodeline(i, words):
+    def is_nodeline(self, i, words):
 
-    if not lines[i][0].isalpha():
-        return 0, 0
+        if not self.lines[i][0].isalpha():
+            return 0, 0
 
-    #if lines[i].startswith('field'):
-    #   return 0, 0
+        #if self.lines[i].startswith('field'):
+        #   return 0, 0
 
-    # Is this a prototype??
-    if lines[i].startswith('PROTO'):
-        words[:] = lines[i].split()
-        return NODE_NORMAL, i + 1  # TODO - assumes the next line is a '[\n', skip that
-    if lines[i].startswith('EXTERNPROTO'):
-        words[:] = lines[i].split()
-        return NODE_ARRAY, i + 1  # TODO - assumes the next line is a '[\n', skip that
+        # Is this a prototype??
+        if self.lines[i].startswith('PROTO'):
+            words[:] = self.lines[i].split()
+            return NODE_NORMAL, i + 1  # TODO - assumes the next line is a '[\n', skip that
+        if self.lines[i].startswith('EXTERNPROTO'):
+            words[:] = self.lines[i].split()
+            return NODE_ARRAY, i + 1  # TODO - assumes the next line is a '[\n', skip that
 
-    '''
-    proto_type, new_i = is_protoline(i, words, proto_field_defs)
-    if new_i != -1:
-        return proto_type, new_i
-    '''
+        '''
+        proto_type, new_i = is_protoline(i, words, proto_field_defs)
+        if new_i != -1:
+            return proto_type, new_i
+        '''
 
-    # Simple "var [" type
-    if lines[i + 1] == '[':
-        if lines[i].count('"') % 2 == 0:
-            words[:] = lines[i].split()
-            return NODE_ARRAY, i + 2
+        # Simple "var [" type
+        if self.lines[i + 1] == '[':
+            if self.lines[i].count('"') % 2 == 0:
+                words[:] = self.lines[i].split()
+                return NODE_ARRAY, i + 2
 
-    node_type, new_i = getNodePreText(i, words)
+        node_type, new_i = self.getNodePreText(i, words)
 
-    if not node_type:
-        if DEBUG:
-            print("not node_type", lines[i])
-        return 0, 0
-
-    # Ok, we have a { after some values
-    # Check the values are not fields
-    for i, val in enumerate(words):
-        if i != 0 and words[i - 1] in {'DEF', 'USE'}:
-            # ignore anything after DEF, it is a ID and can contain any chars.
-            pass
-        elif val[0].isalpha() and val not in {'TRUE', 'FALSE'}:
-            pass
-        else:
-            # There is a number in one of the values, therefor we are not a node.
+        if not node_type:
+            if DEBUG:
+                print("not node_type", self.lines[i])
             return 0, 0
 
-    #if node_type==NODE_REFERENCE:
-    #   print(words, "REF_!!!!!!!")
-    return node_type, new_i
+        # Ok, we have a { after some values
+        # Check the values are not fields
+        for i, val in enumerate(words):
+            if i != 0 and words[i - 1] in {'DEF', 'USE'}:
+                # ignore anything after DEF, it is a ID and can contain any chars.
+                pass
+            elif val[0].isalpha() and val not in {'TRUE', 'FALSE'}:
+                pass
+            else:
+                # There is a number in one of the values, therefor we are not a node.
+                return 0, 0
 
+        #if node_type==NODE_REFERENCE:
+        #   print(words, "REF_!!!!!!!")
+        return node_type, new_i
 
-def is_numline(i):
-    """
-    Does this line start with a number?
-    """
+    def is_numline(self, i):
+        """
+        Does this line start with a number?
+        """
 
-    # Works but too slow.
-    '''
-    l = lines[i]
-    for w in l.split():
-        if w==',':
-            pass
-        else:
-            try:
-                float(w)
-                return True
+        # Works but too slow.
+        '''
+        l = self.lines[i]
+        for w in l.split():
+            if w==',':
+                pass
+            else:
+                try:
+                    float(w)
+                    return True
 
-            except:
-                return False
+                except:
+                    return False
 
-    return False
-    '''
+        return False
+        '''
 
-    l = lines[i]
+        l = self.lines[i]
 
-    line_start = 0
+        line_start = 0
 
-    if l.startswith(', '):
-        line_start += 2
+        if l.startswith(', '):
+            line_start += 2
 
-    line_end = len(l) - 1
-    line_end_new = l.find(' ', line_start)  # comma's always have a space before them
+        line_end = len(l) - 1
+        line_end_new = l.find(' ', line_start)  # comma's always have a space before them
 
-    if line_end_new != -1:
-        line_end = line_end_new
+        if line_end_new != -1:
+            line_end = line_end_new
 
-    try:
-        float(l[line_start:line_end])  # works for a float or int
-        return True
-    except:
-        return False
+        try:
+            float(l[line_start:line_end])  # works for a float or int
+            return True
+        except:
+            return False
 
 
 class vrmlNode(object):
@@ -383,7 +477,10 @@ class vrmlNode(object):
                  'ROUTE_IPO_NAMESPACE',
                  'PROTO_NAMESPACE',
                  'x3dNode',
-                 'parsed')
+                 'parsed',
+                 'field_index',
+                 'child_index',
+                 'proto_lookups')
 
     def __init__(self, parent, node_type, lineno):
         self.id = None
@@ -393,6 +490,10 @@ class vrmlNode(object):
         self.blendData = None
         self.x3dNode = None  # for x3d import only
         self.parsed = None  # We try to reuse objects in a smart way
+        # Built on first field access, fields dont change once parsed. See getFieldName()
+        self.field_index = None
+        self.child_index = None
+        self.proto_lookups = None
         if parent:
             parent.children.append(self)
 
@@ -600,82 +701,113 @@ class vrmlNode(object):
             child.searchNodeTypeID(node_spec, results)
         return results
 
+    def buildFieldIndex(self):
+        """
+        Map field names to the first field and single id child of that name,
+        same as the linear search in getFieldName() used to find.
+        """
+        field_index = {}
+        for f in self.fields:
+            if f and f[0] not in field_index:
+                field_index[f[0]] = f
+
+        child_index = {}
+        for child in self.children:
+            if child.id and len(child.id) == 1 and child.id[0] not in child_index:
+                child_index[child.id[0]] = child
+
+        self.field_index = field_index
+        self.child_index = child_index
+
     def getFieldName(self, field, ancestry, AS_CHILD=False, SPLIT_COMMAS=False):
         self_real = self.getRealNode()  # in case we're an instance
 
-        for f in self_real.fields:
-            # print(f)
-            if f and f[0] == field:
-                # print('\tfound field', f)
+        if self_real.field_index is None:
+            self_real.buildFieldIndex()
 
-                if len(f) >= 3 and f[1] == 'IS':  # eg: 'diffuseColor IS legColor'
-                    field_id = f[2]
+        f = self_real.field_index.get(field)
+        if f is not None:
+            # print('\tfound field', f)
 
-                    # print("\n\n\n\n\n\nFOND IS!!!")
-                    f_proto_lookup = None
-                    f_proto_child_lookup = None
-                    i = len(ancestry)
-                    while i:
-                        i -= 1
-                        node = ancestry[i]
-                        node = node.getRealNode()
-
-                        # proto settings are stored in "self.proto_node"
-                        if node.proto_node:
-                            # Get the default value from the proto, this can be overwridden by the proto instace
-                            # 'field SFColor legColor .8 .4 .7'
-                            if AS_CHILD:
-                                for child in node.proto_node.children:
-                                    #if child.id  and  len(child.id) >= 3  and child.id[2]==field_id:
-                                    if child.id and ('point' in child.id or 'points' in child.id):
-                                        f_proto_child_lookup = child
-
-                            else:
-                                for f_def in node.proto_node.proto_field_defs:
-                                    if len(f_def) >= 4:
-                                        if f_def[0] == 'field' and f_def[2] == field_id:
-                                            f_proto_lookup = f_def[3:]
-
-                        # Node instance, Will be 1 up from the proto-node in the ancestry list. but NOT its parent.
-                        # This is the setting as defined by the instance, including this setting is optional,
-                        # and will override the default PROTO value
-                        # eg: 'legColor 1 0 0'
-                        if AS_CHILD:
-                            for child in node.children:
-                                if child.id and child.id[0] == field_id:
-                                    f_proto_child_lookup = child
-                        else:
-                            for f_def in node.fields:
-                                if len(f_def) >= 2:
-                                    if f_def[0] == field_id:
-                                        if DEBUG:
-                                            print("getFieldName(), found proto", f_def)
-                                        f_proto_lookup = f_def[1:]
+            if len(f) >= 3 and f[1] == 'IS':  # eg: 'diffuseColor IS legColor'
+                # The lookup only depends on the proto instances above us, shape instances
+                # share it so only do the walk once per ancestry
+                key = (f[2], AS_CHILD, tuple(ancestry))
+                if self_real.proto_lookups is None:
+                    self_real.proto_lookups = {}
+                try:
+                    return self_real.proto_lookups[key]
+                except KeyError:
+                    pass
 
-                    if AS_CHILD:
-                        if f_proto_child_lookup:
-                            if DEBUG:
-                                print("getFieldName() - AS_CHILD=True, child found")
-                                print(f_proto_child_lookup)
-                        return f_proto_child_lookup
-                    else:
-                        return f_proto_lookup
+                value = self_real.protoFieldLookup(f[2], ancestry, AS_CHILD)
+                self_real.proto_lookups[key] = value
+                return value
+            else:
+                if AS_CHILD:
+                    return None
                 else:
-                    if AS_CHILD:
-                        return None
-                    else:
-                        # Not using a proto
-                        return f[1:]
+                    # Not using a proto
+                    return f[1:]
         # print('\tfield not found', field)
 
         # See if this is a proto name
         if AS_CHILD:
-            for child in self_real.children:
-                if child.id and len(child.id) == 1 and child.id[0] == field:
-                    return child
+            return self_real.child_index.get(field)
 
         return None
 
+    def protoFieldLookup(self, field_id, ancestry, AS_CHILD):
+        # print("\n\n\n\n\n\nFOND IS!!!")
+        f_proto_lookup = None
+        f_proto_child_lookup = None
+        i = len(ancestry)
+        while i:
+            i -= 1
+            node = ancestry[i]
+            node = node.getRealNode()
+
+            # proto settings are stored in "self.proto_node"
+            if node.proto_node:
+                # Get the default value from the proto, this can be overwridden by the proto instace
+                # 'field SFColor legColor .8 .4 .7'
+                if AS_CHILD:
+                    for child in node.proto_node.children:
+                        #if child.id  and  len(child.id) >= 3  and child.id[2]==field_id:
+                        if child.id and ('point' in child.id or 'points' in child.id):
+                            f_proto_child_lookup = child
+
+                else:
+                    for f_def in node.proto_node.proto_field_defs:
+                        if len(f_def) >= 4:
+                            if f_def[0] == 'field' and f_def[2] == field_id:
+                                f_proto_lookup = f_def[3:]
+
+            # Node instance, Will be 1 up from the proto-node in the ancestry list. but NOT its parent.
+            # This is the setting as defined by the instance, including this setting is optional,
+            # and will override the default PROTO value
+            # eg: 'legColor 1 0 0'
+            if AS_CHILD:
+                for child in node.children:
+                    if child.id and child.id[0] == field_id:
+                        f_proto_child_lookup = child
+            else:
+                for f_def in node.fields:
+                    if len(f_def) >= 2:
+                        if f_def[0] == field_id:
+                            if DEBUG:
+                                print("getFieldName(), found proto", f_def)
+                            f_proto_lookup = f_def[1:]
+
+        if AS_CHILD:
+            if f_proto_child_lookup:
+                if DEBUG:
+                    print("getFieldName() - AS_CHILD=True, child found")
+                    print(f_proto_child_lookup)
+            return f_proto_child_lookup
+        else:
+            return f_proto_lookup
+
     def getFieldAsInt(self, field, default, ancestry):
         self_real = self.getRealNode()  # in case we're an instance
 
@@ -794,14 +926,10 @@ class vrmlNode(object):
         """
 
         def array_as_number(array_string):
-            array_data = []
-            try:
-                array_data = [int(val, 0) for val in array_string]
-            except:
-                try:
-                    array_data = [float(val) for val in array_string]
-                except:
-                    print('\tWarning, could not parse array data from field')
+            array_data = vrml_number_array(array_string, int_auto)
+            if array_data is None:
+                print('\tWarning, could not parse array data from field')
+                return []
 
             return array_data
 
@@ -833,12 +961,13 @@ class vrmlNode(object):
         if group == -1 or len(array_data) == 0:
             return array_data
 
-        # We want a flat list
+        # We want a flat list, typed arrays always are
         flat = True
-        for item in array_data:
-            if type(item) == list:
-                flat = False
-                break
+        if type(array_data) is not array:
+            for item in array_data:
+                if type(item) == list:
+                    flat = False
+                    break
 
         # make a flat array
         if flat:
@@ -859,17 +988,15 @@ class vrmlNode(object):
         if group == 0:
             return flat_array
 
-        new_array = []
-        sub_array = []
+        # Rows are plain lists, callers concatenate and index them
+        if type(flat_array) is array:
+            flat_array = flat_array.tolist()
 
-        for item in flat_array:
-            sub_array.append(item)
-            if len(sub_array) == group:
-                new_array.append(sub_array)
-                sub_array = []
+        aligned = len(flat_array) - len(flat_array) % group
+        new_array = [flat_array[j:j + group] for j in range(0, aligned, group)]
 
-        if sub_array:
-            print('\twarning, array was not aligned to requested grouping', group, 'remaining value', sub_array)
+        if aligned != len(flat_array):
+            print('\twarning, array was not aligned to requested grouping', group, 'remaining value', flat_array[aligned:])
 
         return new_array
 
@@ -958,8 +1085,8 @@ class vrmlNode(object):
 
         return text
 
-    def parse(self, i, IS_PROTO_DATA=False):
-        new_i = self.__parse(i, IS_PROTO_DATA)
+    def parse(self, parser, i, IS_PROTO_DATA=False):
+        new_i = self.__parse(parser, i, IS_PROTO_DATA)
 
         # print(self.id, self.getFilename())
 
@@ -1034,22 +1161,12 @@ class vrmlNode(object):
                             # Tricky - inline another VRML
                             print('\tLoading Inline:"%s"...' % url)
 
-                            # Watch it! - backup lines
-                            lines_old = lines[:]
-
-                            lines[:] = vrmlFormat(data)
-
-                            lines.insert(0, '{')
-                            lines.insert(0, 'root_node____')
-                            lines.append('}')
-                            '''
-                            ff = open('/tmp/test.txt', 'w')
-                            ff.writelines([l+'\n' for l in lines])
-                            '''
+                            # The inline gets its own parser, the lines of this file are untouched
+                            inline_parser = vrmlParser(['root_node____', '{'] + vrmlFormat(data) + ['}'])
 
                             child = vrmlNode(self, NODE_NORMAL, -1)
                             child.setRoot(url)  # initialized dicts
-                            child.parse(0)
+                            child.parse(inline_parser, 0)
 
                             # if self.getExternprotoName():
                             if self.getExternprotoName():
@@ -1072,16 +1189,14 @@ class vrmlNode(object):
                                     else:
                                         print("\tEXTERNPROTO ID not found!:", extern_key)
 
-                            # Watch it! - restore lines
-                            lines[:] = lines_old
-
         return new_i
 
-    def __parse(self, i, IS_PROTO_DATA=False):
+    def __parse(self, parser, i, IS_PROTO_DATA=False):
         '''
         print('parsing at', i, end="")
         print(i, self.id, self.lineno)
         '''
+        lines = parser.lines
         l = lines[i]
 
         if l == '[':
@@ -1091,7 +1206,7 @@ class vrmlNode(object):
         else:
             words = []
 
-            node_type, new_i = is_nodeline(i, words)
+            node_type, new_i = parser.is_nodeline(i, words)
             if not node_type:  # fail for parsing new node.
                 print("Failed to parse new node")
                 raise ValueError
@@ -1121,7 +1236,7 @@ class vrmlNode(object):
 
                 # Parse the proto nodes fields
                 self.proto_node = vrmlNode(self, NODE_ARRAY, new_i)
-                new_i = self.proto_node.parse(new_i)
+                new_i = self.proto_node.parse(parser, new_i)
 
                 self.children.remove(self.proto_node)
 
@@ -1170,41 +1285,26 @@ class vrmlNode(object):
                 ### print("returning", i)
                 return i + 1
 
-            node_type, new_i = is_nodeline(i, [])
+            node_type, new_i = parser.is_nodeline(i, [])
             if node_type:  # check text\n{
                 child = vrmlNode(self, node_type, i)
-                i = child.parse(i)
+                i = child.parse(parser, i)
 
             elif l == '[':  # some files have these anonymous lists
                 child = vrmlNode(self, NODE_ARRAY, i)
-                i = child.parse(i)
-
-            elif is_numline(i):
-                l_split = l.split(',')
-
-                values = None
-                # See if each item is a float?
-
-                for num_type in (int, float):
-                    try:
-                        values = [num_type(v) for v in l_split]
-                        break
-                    except:
-                        pass
+                i = child.parse(parser, i)
 
-                    try:
-                        values = [[num_type(v) for v in segment.split()] for segment in l_split]
-                        break
-                    except:
-                        pass
+            elif parser.is_numline(i):
+                # Commas only separate rows, which getFieldAsArray() regroups anyway
+                values = vrml_number_array(l.replace(',', ' ').split())
 
                 if values is None:  # dont parse
-                    values = l_split
+                    values = l.split(',')
 
                 # This should not extend over multiple lines however it is possible
                 # print(self.array_data)
                 if values:
-                    self.array_data.extend(values)
+                    self.array_data = vrml_array_extend(self.array_data, values)
                 i += 1
             else:
                 words = l.split()
@@ -1251,84 +1351,782 @@ class vrmlNode(object):
     def canHaveReferences(self):
         return self.node_type == NODE_NORMAL and self.getDefName()
 
-    # This is a prerequisite for raw XML-based material caching. For now, only for X3D
+    # This is a prerequisite for description-based material caching.
+    # X3D uses the raw XML, VRML Material nodes their values, in the
+    # appearance_CreateMaterialFromValues() order. Fields set with IS
+    # depend on the proto instance, those aren't cached.
     def desc(self):
-        return None
+        node = self.getRealNode()
+        if node.getSpec() != 'Material':
+            return None
 
+        if node.field_index is None:
+            node.buildFieldIndex()
+        for f in node.field_index.values():
+            if len(f) >= 3 and f[1] == 'IS':
+                return None
 
-def gzipOpen(path):
+        return ('Material',
+                node.getFieldAsFloat('ambientIntensity', 0.2, None),
+                tuple(node.getFieldAsFloatTuple('diffuseColor', (0.8, 0.8, 0.8), None)),
+                tuple(node.getFieldAsFloatTuple('emissiveColor', (0.0, 0.0, 0.0), None)),
+                node.getFieldAsFloat('shininess', 0.2, None),
+                tuple(node.getFieldAsFloatTuple('specularColor', (0.0, 0.0, 0.0), None)),
+                node.getFieldAsFloat('transparency', 0.0, None))
+
+
+def vrmlReadChunks(path, chunk_size=1 << 20):
+    """
+    Return an iterator over the decoded text of the file in chunks, None if it cant be opened.
+    Gzip files are recognized by their magic bytes and decompressed as they are read,
+    plain files are memory mapped, so the whole file is never held in memory.
+    Newlines are normalized like text mode did.
+    """
     import gzip
+    import mmap
 
-    data = None
     try:
-        data = gzip.open(path, 'r').read()
+        f = open(path, 'rb')
     except:
+        import traceback
+        traceback.print_exc()
+        return None
+
+    if f.read(2) == b'\x1f\x8b':
+        f.seek(0)
+        source = gzip.GzipFile(fileobj=f)
+    else:
+        try:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files cant be mapped
+            source = f
+        source.seek(0)
+
+    return vrml_decode_chunks(f, source, chunk_size)
+
+
+def vrml_decode_chunks(f, source, chunk_size):
+    import codecs
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='surrogateescape')
+    try:
+        cr = ''  # a trailing '\r' may be the first half of '\r\n'
+        while True:
+            raw = source.read(chunk_size)
+            final = not raw
+            text = cr + decoder.decode(raw, final)
+            cr = ''
+            if not final and text.endswith('\r'):
+                cr = '\r'
+                text = text[:-1]
+
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+            if text:
+                yield text
+            if final:
+                break
+    finally:
+        if source is not f:
+            source.close()
+        f.close()
+
+
+# Exporters the clean up reports on, found by name in the file header
+VRML_EXPORTERS = ('PyMOL', 'Chimera', 'Jmol')
+
+
+def vrml_sniff_exporter(path, size=4096):
+    """
+    Return which of VRML_EXPORTERS wrote the file (VRML or X3D), going by the
+    comments and metadata at its start, or 'unknown'.
+    """
+    chunks = vrmlReadChunks(path, size)
+    if chunks is None:
+        return 'unknown'
+    try:
+        head = next(chunks, '').lower()
+    finally:
+        chunks.close()
+
+    for name in VRML_EXPORTERS:
+        if name.lower() in head:
+            return name
+    return 'unknown'
+
+
+def gzipOpen(path):
+    chunks = vrmlReadChunks(path)
+    if chunks is None:
+        return None
+
+    return ''.join(chunks)
+
+
+VRML_WRAP_START = 4  # lines of the root and dummy node wrapper, see vrml_read()
+
+
+def vrml_read(path, profiler=None):
+    """
+    Reads and formats the file.
+    Return the lines wrapped in the root and dummy nodes vrml_parse() expects, or None
+    """
+    chunks = vrmlReadChunks(path)
+
+    if chunks is None:
+        return None
+
+    if profiler:
+        # Reading happens while formatting, time it separately and leave it out of format
+        chunks = profiler.iterate('read', chunks)
+        read_phase = profiler.phases.setdefault('read', [0.0, 0, 0])
+        read_seconds, read_blocks = read_phase[0], read_phase[1]
+        token = profiler.begin()
+
+    # Stripped above. The root and dummy node wrappers go in up front so the
+    # token lines never have to be shifted with insert(0, ...)
+    lines = ['root_node____', '{', 'dymmy_node', '{']  # important the name starts with an ascii char
+    lines.extend(vrml_tokenize(chunks))
+    lines += ['}', '}']
+
+    if profiler:
+        token = (token[0] + read_phase[0] - read_seconds, token[1] + read_phase[1] - read_blocks)
+        profiler.end('format', token)
+    return lines
+
+
+def vrml_parse(path, lines=None):
+    """
+    Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
+    Lines from vrml_read() can be passed in when the file was already read.
+    Return root (vrmlNode, '') or (None, 'Error String')
+    """
+    if lines is None:
+        lines = vrml_read(path)
+
+        if lines is None:
+            return None, 'Failed to open file: ' + path
+
+    parser = vrmlParser(lines)
+    # Use for testing our parsed output, so we can check on line numbers.
+
+    '''
+    ff = open('/tmp/test.txt', 'w')
+    ff.writelines([l+'\n' for l in lines])
+    ff.close()
+    '''
+
+    # Now evaluate it, skipping the root wrapper
+    node_type, new_i = parser.is_nodeline(2, [])
+    if not node_type:
+        return None, 'Error: VRML file has no starting Node'
+
+    root = vrmlNode(None, NODE_NORMAL, -1)
+    root.setRoot(path)  # we need to set the root so we have a namespace and know the path in case of inlineing
+
+    # Parse recursively
+    root.parse(parser, 0)
+
+    # This prints a load of text
+    if DEBUG:
+        print(root)
+
+    return root, ''
+
+
+# ====================== Molecular fast path
+# Ball and stick exports (PyMOL, Chimera...) are only Transforms around Shapes with a
+# Sphere or Cylinder and a Material. These are read straight from the formatted lines
+# into flat columns, skipping the vrmlNode tree, its serialization and the per node
+# ancestry matrices. Anything else makes the reader give up and the file goes through
+# vrml_parse() as usual.
+
+PRIM_SPHERE = 0
+PRIM_CYLINDER = 1
+PRIM_SPECS = ('Sphere', 'Cylinder')
+
+# flags column
+PRIM_TOP = 1
+PRIM_BOTTOM = 2
+PRIM_SIDE = 4
+PRIM_RADIUS = 8  # radius was in the file, not the default
+
+
+def primitive_radius_property(radius, flags):
+    """
+    The "radius" object property of a table row: the file's radius, 0 when the file
+    has none, same as the generic path (see vrml_geometry_radius()).
+    """
+    return radius if flags & PRIM_RADIUS else 0
+
+
+def vrml_geometry_radius(geom, ancestry, default):
+    """
+    (radius for the mesh, "radius" object property) of a Sphere or Cylinder node.
+    The property is 0 when the file has no radius field, as in the primitive table.
+    """
+    radius = geom.getFieldAsFloat('radius', None, ancestry)
+    if radius is None:
+        return default, 0
+    return radius, radius
+
+# Nodes that dont make geometry. Lights and cameras are dropped, MolPrint clean removes them anyway.
+VRML_PRIM_SKIP = {'Viewpoint', 'NavigationInfo', 'WorldInfo', 'Background', 'Fog',
+                  'DirectionalLight', 'PointLight', 'SpotLight'}
+
+# Every field the reader understands, anything else gives up
+VRML_PRIM_FIELDS = {
+    'Transform': {'translation', 'rotation', 'scale', 'scaleOrientation', 'center',
+                  'children', 'bboxCenter', 'bboxSize'},
+    'Group': {'children', 'bboxCenter', 'bboxSize'},
+    'Shape': {'geometry', 'appearance'},
+    'Appearance': {'material'},
+    'Material': {'ambientIntensity', 'diffuseColor', 'emissiveColor', 'shininess',
+                 'specularColor', 'transparency'},
+    'Sphere': {'radius'},
+    'Cylinder': {'radius', 'height', 'bottom', 'top', 'side'},
+}
+
+MATRIX_IDENTITY = (1.0, 0.0, 0.0, 0.0,
+                   0.0, 1.0, 0.0, 0.0,
+                   0.0, 0.0, 1.0, 0.0,
+                   0.0, 0.0, 0.0, 1.0)
+
+
+def matrix_multiply(a, b):
+    """
+    a * b for 4x4 matrices as 16 floats, row major like mathutils.Matrix rows
+    """
+    return tuple(a[r] * b[c] + a[r + 1] * b[c + 4] + a[r + 2] * b[c + 8] + a[r + 3] * b[c + 12]
+                 for r in (0, 4, 8, 12) for c in range(4))
+
+
+def matrix_translation(t):
+    return (1.0, 0.0, 0.0, t[0],
+            0.0, 1.0, 0.0, t[1],
+            0.0, 0.0, 1.0, t[2],
+            0.0, 0.0, 0.0, 1.0)
+
+
+def matrix_rotation(rot):
+    """
+    axis, angle, same as mathutils.Matrix.Rotation(rot[3], 4, rot[:3])
+    """
+    x, y, z, angle = rot
+    length = math.sqrt(x * x + y * y + z * z)
+    if length == 0.0:
+        return MATRIX_IDENTITY
+
+    x /= length
+    y /= length
+    z /= length
+    c = cos(angle)
+    s = sin(angle)
+    t = 1.0 - c
+    return (t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0.0,
+            t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0.0,
+            t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0.0,
+            0.0, 0.0, 0.0, 1.0)
+
+
+def matrix_scale(sca):
+    return (sca[0], 0.0, 0.0, 0.0,
+            0.0, sca[1], 0.0, 0.0,
+            0.0, 0.0, sca[2], 0.0,
+            0.0, 0.0, 0.0, 1.0)
+
+
+def matrix_vrml_transform(tx, cent, rot, sca, scaori):
+    """
+    Local matrix of a Transform node from its (optional) field values,
+    same order as translateTransform()
+    """
+    mats = [matrix_translation(tx) if tx else None,
+            matrix_translation(cent) if cent else None,
+            matrix_rotation(rot) if rot else None,
+            matrix_rotation(scaori) if scaori else None,
+            matrix_scale(sca) if sca else None,
+            matrix_rotation(scaori[:3] + [-scaori[3]]) if scaori else None,
+            matrix_translation([-v for v in cent]) if cent else None]
+
+    new_mat = MATRIX_IDENTITY
+    for mtx in mats:
+        if mtx:
+            new_mat = matrix_multiply(new_mat, mtx)
+    return new_mat
+
+
+class vrmlPrimitiveTable(object):
+    """
+    Spheres and cylinders of a ball and stick scene as flat columns, one row per shape.
+    matrices holds 16 floats per row, row major.
+    """
+    __slots__ = ('ptypes',
+                 'matrices',
+                 'radii',
+                 'heights',
+                 'flags',
+                 'material_ids',
+                 'materials')
+
+    def __init__(self):
+        self.ptypes = array('B')  # PRIM_SPHERE, PRIM_CYLINDER
+        self.matrices = array('d')
+        self.radii = array('d')
+        self.heights = array('d')  # 0.0 for spheres
+        self.flags = array('B')  # PRIM_TOP | PRIM_BOTTOM...
+        self.material_ids = array('i')  # index into materials, -1 when the shape has no Appearance
+        # unique (ambient, diffuse, emissive, shininess, specular, transparency) tuples,
+        # None for an Appearance without a Material
+        self.materials = []
+
+    # Write order for the cache, largest items first so every column stays aligned
+    COLUMNS = ('matrices', 'radii', 'heights', 'material_ids', 'ptypes', 'flags')
+
+    def __len__(self):
+        return len(self.ptypes)
+
+    def write(self, f):
+        """
+        A json header line then the raw bytes of each column
+        """
+        columns = [(name, getattr(self, name)) for name in self.COLUMNS]
+        header = json.dumps({'version': PRIMITIVE_CACHE_VERSION,
+                             'columns': [[name, col.typecode, len(col)] for name, col in columns],
+                             'materials': self.materials}).encode('utf-8')
+        header += b' ' * (-(len(header) + 1) % 8) + b'\n'
+        f.write(header)
+        for name, col in columns:
+            col.tofile(f)
+
+    @classmethod
+    def fromBuffer(cls, buf):
+        """
+        Table for the bytes written by write(), the columns are memoryviews into buf (eg. an mmap)
+        so nothing is copied. Return None for an old or broken cache file.
+        """
+        try:
+            header_end = buf.find(b'\n') + 1
+            header = json.loads(bytes(buf[:header_end]).decode('utf-8'))
+            if header['version'] != PRIMITIVE_CACHE_VERSION:
+                return None
+
+            table = cls()
+            view = memoryview(buf)
+            offset = header_end
+            for name, typecode, count in header['columns']:
+                nbytes = count * array(typecode).itemsize
+                col = view[offset:offset + nbytes].cast(typecode)
+                if len(col) != count:
+                    return None  # truncated
+                setattr(table, name, col)
+                offset += nbytes
+
+            table.materials = [None if values is None else
+                               tuple(tuple(v) if type(v) is list else v for v in values)
+                               for values in header['materials']]
+        except (ValueError, TypeError, KeyError):
+            return None
+
+        return table
+
+    def append(self, ptype, matrix, radius, height, flags, material_id):
+        self.ptypes.append(ptype)
+        self.matrices.extend(matrix)
+        self.radii.append(radius)
+        self.heights.append(height)
+        self.flags.append(flags)
+        self.material_ids.append(material_id)
+
+
+class vrmlPrimitiveMiss(Exception):
+    """
+    Raised when the file isnt a plain primitive scene
+    """
+    pass
+
+
+class vrmlPrimitiveReader(object):
+    """
+    Recognizes Transform/Group/Shape/Sphere/Cylinder/Material scenes in formatted lines.
+    read() returns a vrmlPrimitiveTable or None when anything else is in the file.
+    """
+    __slots__ = ('lines',
+                 'material_ids',
+                 'table',
+                 'skip_i')
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.material_ids = {}
+        self.table = vrmlPrimitiveTable()
+        self.skip_i = 0
+
+    def read(self, i, end):
+        lines = self.lines
+        try:
+            while i < end:
+                words = lines[i].split()
+                if len(words) != 1 or lines[i + 1] != '{':
+                    raise vrmlPrimitiveMiss()  # DEF, ROUTE, PROTO...
+
+                records, value = self.readNode(words[0], i + 2)
+                if value is not None:
+                    raise vrmlPrimitiveMiss()  # geometry or material outside of a Shape
+
+                for matrix, ptype, radius, height, flags, material_id in records:
+                    self.table.append(ptype, matrix, radius, height, flags, material_id)
+                i = self.skip_i
+        except (vrmlPrimitiveMiss, ValueError, IndexError):
+            return None
+
+        return self.table
+
+    def skipNode(self, i):
+        # i is the line after the opening brace, returns the line after the closing one
+        lines = self.lines
+        depth = 1
+        while depth:
+            l = lines[i]
+            if l in {'{', '['}:
+                depth += 1
+            elif l in {'}', ']'}:
+                depth -= 1
+            i += 1
+        return i
+
+    def readNode(self, spec, i):
+        """
+        Read the node body starting after its '{'.
+        Returns the list of shape records and leaves the line after the '}' in self.skip_i
+        """
+        if spec in VRML_PRIM_SKIP:
+            self.skip_i = self.skipNode(i)
+            return [], None
+
+        known = VRML_PRIM_FIELDS.get(spec)
+        if known is None:
+            raise vrmlPrimitiveMiss()
+
+        lines = self.lines
+        values = {}
+        nodes = {}
+        while True:
+            l = lines[i]
+            if l == '}':
+                break
+            if l == ',':
+                i += 1
+                continue
+
+            words = l.split()
+            name = words[0]
+            if name not in known:
+                raise vrmlPrimitiveMiss()
+
+            if len(words) == 2 and lines[i + 1] == '{':
+                # SFNode, eg: geometry Sphere
+                nodes.setdefault(name, []).append(self.readNode(words[1], i + 2))
+                i = self.skip_i
+            elif len(words) == 1 and lines[i + 1] == '[':
+                # MFNode, eg: children [ ... ]
+                i += 2
+                kids = nodes.setdefault(name, [])
+                while lines[i] != ']':
+                    if lines[i] == ',':
+                        i += 1
+                        continue
+                    kid_words = lines[i].split()
+                    if len(kid_words) != 1 or lines[i + 1] != '{':
+                        raise vrmlPrimitiveMiss()
+                    kids.append(self.readNode(kid_words[0], i + 2))
+                    i = self.skip_i
+                i += 1
+            else:
+                if name in values or 'IS' in words:
+                    raise vrmlPrimitiveMiss()
+                values[name] = [w for w in words[1:] if w != ',']
+                i += 1
+
+        self.skip_i = i + 1
+        return getattr(self, 'make' + spec)(values, nodes)
+
+    # The make* functions turn the values and nodes of a body into the node result.
+    # Grouping nodes return (records, None), the rest (None, value).
+
+    @staticmethod
+    def getFloats(values, name, count, default):
+        words = values.get(name)
+        if words is None:
+            return default
+        if len(words) != count:
+            raise vrmlPrimitiveMiss()
+        return [float(w) for w in words]
+
+    @staticmethod
+    def getBool(values, name, default):
+        words = values.get(name)
+        if words is None:
+            return default
+        if len(words) != 1:
+            raise vrmlPrimitiveMiss()
+        word = words[0].strip('"').upper()
+        if word == 'TRUE':
+            return True
+        elif word == 'FALSE':
+            return False
+        raise vrmlPrimitiveMiss()
+
+    @staticmethod
+    def getNode(nodes, name):
+        results = nodes.get(name)
+        if not results:
+            return None
+        if len(results) != 1 or results[0][1] is None:
+            raise vrmlPrimitiveMiss()
+        return results[0][1]
+
+    def makeGroup(self, values, nodes):
+        records = []
+        for kid_records, value in nodes.get('children', ()):
+            if value is not None:
+                raise vrmlPrimitiveMiss()  # geometry or material outside of a Shape
+            records += kid_records
+        return records, None
+
+    def makeTransform(self, values, nodes):
+        records = self.makeGroup(values, nodes)[0]
+
+        mtx = matrix_vrml_transform(self.getFloats(values, 'translation', 3, None),
+                                    self.getFloats(values, 'center', 3, None),
+                                    self.getFloats(values, 'rotation', 4, None),
+                                    self.getFloats(values, 'scale', 3, None),
+                                    self.getFloats(values, 'scaleOrientation', 4, None))
+        if mtx != MATRIX_IDENTITY:
+            for record in records:
+                record[0] = matrix_multiply(mtx, record[0])
+        return records, None
+
+    def makeShape(self, values, nodes):
+        geom = self.getNode(nodes, 'geometry')
+        if geom is None:
+            return [], None  # Oh well, no geometry node in this shape
+
+        material_id = self.getNode(nodes, 'appearance')
+        if material_id is None:
+            material_id = -1
+        return [[MATRIX_IDENTITY] + geom + [material_id]], None
+
+    def makeAppearance(self, values, nodes):
+        material = self.getNode(nodes, 'material')
+        try:
+            material_id = self.material_ids[material]
+        except KeyError:
+            material_id = self.material_ids[material] = len(self.table.materials)
+            self.table.materials.append(material)
+        return None, material_id
+
+    def makeMaterial(self, values, nodes):
+        return None, (self.getFloats(values, 'ambientIntensity', 1, [0.2])[0],
+                      tuple(self.getFloats(values, 'diffuseColor', 3, [0.8, 0.8, 0.8])),
+                      tuple(self.getFloats(values, 'emissiveColor', 3, [0.0, 0.0, 0.0])),
+                      self.getFloats(values, 'shininess', 1, [0.2])[0],
+                      tuple(self.getFloats(values, 'specularColor', 3, [0.0, 0.0, 0.0])),
+                      self.getFloats(values, 'transparency', 1, [0.0])[0])
+
+    def makeSphere(self, values, nodes):
+        flags = PRIM_RADIUS if 'radius' in values else 0
+        radius = self.getFloats(values, 'radius', 1, [0.5])[0]
+        return None, [PRIM_SPHERE, radius, 0.0, flags]
+
+    def makeCylinder(self, values, nodes):
+        flags = PRIM_RADIUS if 'radius' in values else 0
+        if self.getBool(values, 'top', True):
+            flags |= PRIM_TOP
+        if self.getBool(values, 'bottom', True):
+            flags |= PRIM_BOTTOM
+        if self.getBool(values, 'side', True):
+            flags |= PRIM_SIDE
+        radius = self.getFloats(values, 'radius', 1, [1.0])[0]
+        height = self.getFloats(values, 'height', 1, [2.0])[0]
+        return None, [PRIM_CYLINDER, radius, height, flags]
+
+
+def vrml_read_primitives(lines):
+    """
+    Return a vrmlPrimitiveTable for lines from vrml_read() if the file is only
+    made of sphere and cylinder shapes, otherwise None.
+    """
+    table = vrmlPrimitiveReader(lines).read(VRML_WRAP_START, len(lines) - 2)
+    if not table:
+        return None  # nothing to import, let vrml_parse() report on it
+    return table
+
+
+# Primitive tables are cached on disk by file content, so importing the same
+# file again (eg. after changing the primitive detail) skips reading it.
+PRIMITIVE_CACHE_VERSION = 1  # bump when the reader or vrmlPrimitiveTable changes
+PRIMITIVE_CACHE_EXT = '.prim'
+PRIMITIVE_CACHE_MAX_SIZE = 256 << 20  # bytes, least recently used tables go first
+
+
+def primitive_cache_key(path):
+    """
+    Hex digest of the file content and cache version, None if the file cant be read
+    """
+    import hashlib
+
+    sha = hashlib.sha1(b'molprint primitives %d\0' % PRIMITIVE_CACHE_VERSION)
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    except OSError:
+        return None
+
+    return sha.hexdigest()
+
+
+def primitive_cache_load(cache_dir, key):
+    """
+    Memory map the cached table for key, None when there is no usable one
+    """
+    import mmap
+
+    path = os.path.join(cache_dir, key + PRIMITIVE_CACHE_EXT)
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+
+    try:
+        os.utime(path)  # the mtime is the last use for primitive_cache_evict()
+    except OSError:
         pass
 
-    if data is None:
-        try:
-            filehandle = open(path, 'rU', encoding='utf-8', errors='surrogateescape')
-            data = filehandle.read()
-            filehandle.close()
-        except:
-            import traceback
-            traceback.print_exc()
-    else:
-        data = data.decode(encoding='utf-8', errors='surrogateescape')
+    with f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # empty file
+            return None
+
+    return vrmlPrimitiveTable.fromBuffer(buf)
+
+
+def primitive_cache_save(cache_dir, key, table):
+    path = os.path.join(cache_dir, key + PRIMITIVE_CACHE_EXT)
+    path_tmp = path + '.tmp'
+    try:
+        with open(path_tmp, 'wb') as f:
+            table.write(f)
+        os.replace(path_tmp, path)  # readers never see a half written file
+    except OSError as e:
+        print('\tWarning: could not write the primitive cache:', e)
+        return
+
+    primitive_cache_evict(cache_dir)
+
+
+def primitive_cache_evict(cache_dir, max_size=PRIMITIVE_CACHE_MAX_SIZE):
+    """
+    Remove the least recently used tables until the cache fits in max_size bytes
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith(PRIMITIVE_CACHE_EXT):
+            try:
+                st = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+    entries.sort()
+    for mtime, size, name in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError as e:
+            print('\tWarning: could not remove', name, e)
+            continue
+        total -= size
+
+
+def primitive_cache_clear(cache_dir):
+    for name in os.listdir(cache_dir):
+        if name.endswith(PRIMITIVE_CACHE_EXT):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError as e:
+                print('\tWarning: could not remove', name, e)
 
-    return data
 
+# ====================== END VRML
+
+# ====================== X3d Support
 
-def vrml_parse(path):
+class x3dElement(object):
     """
-    Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
-    Return root (vrmlNode, '') or (None, 'Error String')
+    The parts of a DOM element x3dNode uses, without the memory overhead of minidom.
+    Text, comments and CDATA are not kept.
     """
-    data = gzipOpen(path)
-
-    if data is None:
-        return None, 'Failed to open file: ' + path
+    __slots__ = ('tagName', 'attributes', 'childNodes', 'parse_position')
 
-    # Stripped above
-    lines[:] = vrmlFormat(data)
+    def __init__(self, tagName, attributes):
+        self.tagName = tagName
+        self.attributes = attributes
+        self.childNodes = []
+        self.parse_position = None  # (line, column), only recorded in DEBUG
 
-    lines.insert(0, '{')
-    lines.insert(0, 'dymmy_node')
-    lines.append('}')
-    # Use for testing our parsed output, so we can check on line numbers.
+    def toxml(self):
+        # Canonical text of the element, attribute order doesnt matter. Used as a cache key by desc()
+        attrs = ''.join(' %s="%s"' % item for item in sorted(self.attributes.items()))
+        if not self.childNodes:
+            return '<%s%s/>' % (self.tagName, attrs)
+        return '<%s%s>%s</%s>' % (self.tagName, attrs, ''.join(c.toxml() for c in self.childNodes), self.tagName)
 
-    '''
-    ff = open('/tmp/test.txt', 'w')
-    ff.writelines([l+'\n' for l in lines])
-    ff.close()
-    '''
 
-    # Now evaluate it
-    node_type, new_i = is_nodeline(0, [])
-    if not node_type:
-        return None, 'Error: VRML file has no starting Node'
+def x3d_read_elements(path):
+    """
+    Stream the (optionally gzipped) file through expat and return the root x3dElement,
+    the file is never held in memory as a whole.
+    Return None if the file cant be opened, xml errors are raised.
+    """
+    import gzip
+    import xml.parsers.expat
 
-    # Trick to make sure we get all root nodes.
-    lines.insert(0, '{')
-    lines.insert(0, 'root_node____')  # important the name starts with an ascii char
-    lines.append('}')
+    try:
+        f = open(path, 'rb')
+    except:
+        return None
 
-    root = vrmlNode(None, NODE_NORMAL, -1)
-    root.setRoot(path)  # we need to set the root so we have a namespace and know the path in case of inlineing
+    with f:
+        if f.read(2) == b'\x1f\x8b':
+            f.seek(0)
+            f = gzip.GzipFile(fileobj=f)
+        else:
+            f.seek(0)
 
-    # Parse recursively
-    root.parse(0)
+        parser = xml.parsers.expat.ParserCreate()
+        stack = [x3dElement(None, {})]  # document
 
-    # This prints a load of text
-    if DEBUG:
-        print(root)
+        def start_element(name, attrs):
+            elem = x3dElement(name, attrs)
+            if DEBUG:
+                elem.parse_position = (parser.CurrentLineNumber, parser.CurrentColumnNumber)
+            stack[-1].childNodes.append(elem)
+            stack.append(elem)
 
-    return root, ''
+        def end_element(name):
+            stack.pop()
 
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.ParseFile(f)
 
-# ====================== END VRML
+    return stack[0]
 
-# ====================== X3d Support
 
 # Sane as vrml but replace the parser
 class x3dNode(vrmlNode):
@@ -1338,30 +2136,29 @@ class x3dNode(vrmlNode):
 
     def parse(self, IS_PROTO_DATA=False):
         # print(self.x3dNode.tagName)
-        self.lineno = self.x3dNode.parse_position[0]
+        if self.x3dNode.parse_position:
+            self.lineno = self.x3dNode.parse_position[0]
 
-        define = self.x3dNode.getAttributeNode('DEF')
+        attributes = self.x3dNode.attributes
+        define = attributes.get('DEF')
         if define:
-            self.getDefDict()[define.value] = self
+            self.getDefDict()[define] = self
         else:
-            use = self.x3dNode.getAttributeNode('USE')
+            use = attributes.get('USE')
             if use:
                 try:
-                    self.reference = self.getDefDict()[use.value]
+                    self.reference = self.getDefDict()[use]
                     self.node_type = NODE_REFERENCE
                 except:
-                    print('\tWarning: reference', use.value, 'not found')
+                    print('\tWarning: reference', use, 'not found')
                     self.parent.children.remove(self)
 
                 return
 
         for x3dChildNode in self.x3dNode.childNodes:
-            if x3dChildNode.nodeType in {x3dChildNode.TEXT_NODE, x3dChildNode.COMMENT_NODE, x3dChildNode.CDATA_SECTION_NODE}:
-                continue
-
             node_type = NODE_NORMAL
             # print(x3dChildNode, dir(x3dChildNode))
-            if x3dChildNode.getAttributeNode('USE'):
+            if 'USE' in x3dChildNode.attributes:
                 node_type = NODE_REFERENCE
 
             child = x3dNode(self, node_type, x3dChildNode)
@@ -1374,12 +2171,12 @@ class x3dNode(vrmlNode):
 
     # Used to retain object identifiers from X3D to Blender
     def getDefName(self):
-        node_id = self.x3dNode.getAttributeNode('DEF')
+        node_id = self.x3dNode.attributes.get('DEF')
         if node_id:
-            return node_id.value
-        node_id = self.x3dNode.getAttributeNode('USE')
+            return node_id
+        node_id = self.x3dNode.attributes.get('USE')
         if node_id:
-            return "USE_" + node_id.value
+            return "USE_" + node_id
         return None
 
     # Other funcs operate from vrml, but this means we can wrap XML fields, still use nice utility funcs
@@ -1388,10 +2185,8 @@ class x3dNode(vrmlNode):
         # ancestry and AS_CHILD are ignored, only used for VRML now
 
         self_real = self.getRealNode()  # in case we're an instance
-        field_xml = self.x3dNode.getAttributeNode(field)
-        if field_xml:
-            value = field_xml.value
-
+        value = self.x3dNode.attributes.get(field)
+        if value is not None:
             # We may want to edit. for x3d specific stuff
             # Sucks a bit to return the field name in the list but vrml excepts this :/
             if SPLIT_COMMAS:
@@ -1401,7 +2196,7 @@ class x3dNode(vrmlNode):
             return None
 
     def canHaveReferences(self):
-        return self.x3dNode.getAttributeNode('DEF')
+        return self.x3dNode.attributes.get('DEF')
 
     def desc(self):
         return self.getRealNode().x3dNode.toxml()
@@ -1412,40 +2207,23 @@ def x3d_parse(path):
     Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
     Return root (x3dNode, '') or (None, 'Error String')
     """
-    import xml.dom.minidom
-    import xml.sax
-
-    '''
-    try:    doc = xml.dom.minidom.parse(path)
-    except: return None, 'Could not parse this X3D file, XML error'
-    '''
-
     # Could add a try/except here, but a console error is more useful.
-    data = gzipOpen(path)
+    doc = x3d_read_elements(path)
 
-    if data is None:
+    if doc is None:
         return None, 'Failed to open file: ' + path
 
-    # Enable line number reporting in the parser - kinda brittle
-    def set_content_handler(dom_handler):
-        def startElementNS(name, tagName, attrs):
-            orig_start_cb(name, tagName, attrs)
-            cur_elem = dom_handler.elementStack[-1]
-            cur_elem.parse_position = (parser._parser.CurrentLineNumber, parser._parser.CurrentColumnNumber)
-
-        orig_start_cb = dom_handler.startElementNS
-        dom_handler.startElementNS = startElementNS
-        orig_set_content_handler(dom_handler)
-
-    parser = xml.sax.make_parser()
-    orig_set_content_handler = parser.setContentHandler
-    parser.setContentHandler = set_content_handler
-
-    doc = xml.dom.minidom.parseString(data, parser)
+    # First X3D element, depth first like getElementsByTagName()
+    x3dnode = None
+    elems = doc.childNodes[::-1]
+    while elems:
+        elem = elems.pop()
+        if elem.tagName == 'X3D':
+            x3dnode = elem
+            break
+        elems.extend(elem.childNodes[::-1])
 
-    try:
-        x3dnode = doc.getElementsByTagName('X3D')[0]
-    except:
+    if x3dnode is None:
         return None, 'Not a valid x3d document, cannot import'
 
     bpy.ops.object.select_all(action='DESELECT')
@@ -1456,6 +2234,71 @@ def x3d_parse(path):
 
     return root, ''
 
+class importProfiler(object):
+    """
+    Wall time and the net change of allocated memory blocks for each import phase.
+    Phases add up over all their calls, pass the token from begin() to end().
+    """
+    PHASES = ('read', 'format', 'parse', 'serialize', 'materials', 'mesh build', 'object create',
+              'object link')
+
+    __slots__ = ('phases',
+                 'notes',
+                 'start')
+
+    def __init__(self):
+        self.phases = {}  # name: [seconds, blocks, calls]
+        self.notes = {}  # extra report entries, eg: which import path was taken
+        self.start = self.begin()
+
+    @staticmethod
+    def begin():
+        return time.perf_counter(), sys.getallocatedblocks()
+
+    def end(self, name, token):
+        seconds = time.perf_counter() - token[0]
+        blocks = sys.getallocatedblocks() - token[1]
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = [0.0, 0, 0]
+        phase[0] += seconds
+        phase[1] += blocks
+        phase[2] += 1
+
+    def iterate(self, name, iterable):
+        """
+        Yield the items of iterable, the time spent producing them goes to the name phase
+        """
+        it = iter(iterable)
+        while True:
+            token = self.begin()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.end(name, token)
+                return
+            self.end(name, token)
+            yield item
+
+    def report(self):
+        names = [name for name in self.PHASES if name in self.phases]
+        names += sorted(name for name in self.phases if name not in self.PHASES)
+
+        report = {'total_seconds': time.perf_counter() - self.start[0],
+                  'allocated_blocks': sys.getallocatedblocks() - self.start[1],
+                  'phases': [{'name': name,
+                              'seconds': self.phases[name][0],
+                              'allocated_blocks': self.phases[name][1],
+                              'calls': self.phases[name][2]}
+                             for name in names]}
+        report.update(self.notes)
+        return report
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
 ## f = open('/_Cylinder.wrl', 'r')
 # f = open('/fe/wrl/Vrml/EGS/TOUCHSN.WRL', 'r')
 # vrml_parse('/fe/wrl/Vrml/EGS/TOUCHSN.WRL')
@@ -1477,10 +2320,11 @@ for i, f in enumerate(files):
 # NO BLENDER CODE ABOVE THIS LINE.
 # -----------------------------------------------------------------------------------
 import bpy
+import bmesh
 from bpy_extras import image_utils
 from mathutils import Vector, Matrix, Quaternion
 
-GLOBALS = {'CIRCLE_DETAIL': 96}
+GLOBALS = {'CIRCLE_DETAIL': 96, 'CHORD_ERROR': None, 'SHAPE_SCALE': 1.0, 'EXPORTER': 'unknown', 'PROFILER': None}
 
 
 def translateRotation(rot):
@@ -1580,24 +2424,41 @@ def translateTexTransform(node, ancestry):
 
     return new_mat
 
-def getFinalMatrix(node, mtx, ancestry, global_matrix):
+# World matrices (global_matrix included) of Transform chains, keyed by the ancestry
+# tuple up to and including the last Transform. Shapes under the same Transform
+# share the entry. Only valid for one load_web3d() call, which clears it.
+transform_cache = {}
 
-    transform_nodes = [node_tx for node_tx in ancestry if node_tx.getSpec() == 'Transform']
-    if node.getSpec() == 'Transform':
-        transform_nodes.append(node)
-    transform_nodes.reverse()
 
+def getTransformPathMatrix(path, global_matrix):
+    # Trailing non Transform nodes dont change the matrix
+    i = len(path)
+    while i and path[i - 1].getSpec() != 'Transform':
+        i -= 1
+
+    if i == 0:
+        return global_matrix
+
+    path = path[:i]
+    mtx = transform_cache.get(path)
     if mtx is None:
-        mtx = Matrix()
+        parent_path = path[:-1]
+        mtx = getTransformPathMatrix(parent_path, global_matrix) * translateTransform(path[-1], parent_path)
+        transform_cache[path] = mtx
+    return mtx
+
 
-    for node_tx in transform_nodes:
-        mat = translateTransform(node_tx, ancestry)
-        mtx = mat * mtx
+def getFinalMatrix(node, mtx, ancestry, global_matrix):
+    ancestry = tuple(ancestry)
+    if node.getSpec() == 'Transform':
+        ancestry += (node,)
 
     # worldspace matrix
-    mtx = global_matrix * mtx
+    world_mtx = getTransformPathMatrix(ancestry, global_matrix)
 
-    return mtx
+    if mtx is None:
+        return world_mtx.copy()
+    return world_mtx * mtx
 
 
 # -----------------------------------------------------------------------------------
@@ -1657,11 +2518,14 @@ def importMesh_ApplyNormals(bpymesh, geom, ancestry):
 # Vertex culling that we have in IndexedFaceSet is an unfortunate exception,
 # brought forth by a very specific issue.
 def importMesh_ReadVertices(bpymesh, geom, ancestry):
-    # We want points here as a flat array, but the caching logic in
-    # IndexedFaceSet presumes a 2D one.
-    # The case for caching is stronger over there.
+    # We want points here as a flat array, same as the cache that
+    # IndexedFaceSet keeps on the Coordinate node, so reuse it.
     coord = geom.getChildBySpec('Coordinate')
-    points = coord.getFieldAsArray('point', 0, ancestry)
+    points = coord.getRealNode().parsed if coord.reference else None
+    if points is None:
+        points = vrml_float_array(coord.getFieldAsArray('point', 0, ancestry))
+        if coord.canHaveReferences():
+            coord.parsed = points
     bpymesh.vertices.add(len(points) // 3)
     bpymesh.vertices.foreach_set("co", points)
 
@@ -1714,9 +2578,6 @@ def importMesh_ApplyTextureToLoops(bpymesh, bpyima, loops):
     bpymesh.uv_layers[0].data.foreach_set('uv', loops)
 
 
-def flip(r, ccw):
-    return r if ccw else r[::-1]
-
 # -----------------------------------------------------------------------------------
 # Now specific geometry importers
 
@@ -1877,12 +2738,9 @@ def importMesh_IndexedFaceSet(geom, ancestry, bpyima):
     coord = geom.getChildBySpec('Coordinate')
     if coord.reference:
         points = coord.getRealNode().parsed
-        # We need unflattened coord array here, while
-        # importMesh_ReadVertices uses flattened. Can't cache both :(
-        # TODO: resolve that somehow, so that vertex set can be effectively
-        # reused between different mesh types?
     else:
-        points = coord.getFieldAsArray('point', 3, ancestry)
+        # Flat, so a typed array goes to foreach_set as is
+        points = vrml_float_array(coord.getFieldAsArray('point', 0, ancestry))
         if coord.canHaveReferences():
             coord.parsed = points
     index = geom.getFieldAsArray('coordIndex', 0, ancestry)
@@ -1890,41 +2748,29 @@ def importMesh_IndexedFaceSet(geom, ancestry, bpyima):
     while index and index[-1] == -1:
         del index[-1]
 
-    if len(points) >= 2 * len(index):  # Need to cull
-        culled_points = []
-        cull = {}  # Maps old vertex indices to new ones
-        uncull = []  # Maps new indices to the old ones
-        new_index = 0
-    else:
-        uncull = cull = None
-
-    faces = []
-    face = []
-    # Generate faces. Cull the vertices if necessary,
-    for i in index:
-        if i == -1:
-            if face:
-                faces.append(flip(face, ccw))
-            face = []
-        else:
-            if cull is not None:
-                if not(i in cull):
-                    culled_points.append(points[i])
-                    cull[i] = new_index
-                    uncull.append(i)
-                    i = new_index
-                    new_index += 1
-                else:
-                    i = cull[i]
-            face.append(i)
-    if face:
-        faces.append(flip(face, ccw))  # The last face
+    points, faces, uncull = vrml_index_faces(points, index, ccw)
 
-    if cull:
-        points = culled_points
+    # Same result as from_pydata() but without a tuple per vertex and face
+    loop_verts = array('i')
+    loop_totals = array('i')
+    for f in faces:
+        loop_verts.extend(f)
+        loop_totals.append(len(f))
+    loop_starts = array('i', [0]) * len(faces)
+    total = 0
+    for j, n in enumerate(loop_totals):
+        loop_starts[j] = total
+        total += n
 
     bpymesh = bpy.data.meshes.new(name="IndexedFaceSet")
-    bpymesh.from_pydata(points, [], faces)
+    bpymesh.vertices.add(len(points) // 3)
+    bpymesh.vertices.foreach_set("co", points)
+    bpymesh.loops.add(len(loop_verts))
+    bpymesh.loops.foreach_set("vertex_index", loop_verts)
+    bpymesh.polygons.add(len(faces))
+    bpymesh.polygons.foreach_set("loop_start", loop_starts)
+    bpymesh.polygons.foreach_set("loop_total", loop_totals)
+    bpymesh.update(calc_edges=True)
     # No validation here. It throws off the per-face stuff.
 
     # Similar treatment for normal and color indices
@@ -1999,7 +2845,7 @@ def importMesh_IndexedFaceSet(geom, ancestry, bpyima):
             for f in faces:
                 # Unused vertices don't participate in size; X3DOM does so
                 for v in f:
-                    (x, y, z) = points[v]
+                    (x, y, z) = points[3 * v:3 * v + 3]
                     if x_min is None or x < x_min:
                         x_min = x
                     if x_max is None or x > x_max:
@@ -2027,7 +2873,7 @@ def importMesh_IndexedFaceSet(geom, ancestry, bpyima):
             def generatePointCoords(pt):
                 return (pt[s_axis] - s_min) / ds, (pt[t_axis] - t_min) / dt
             loops = [co for f in faces for v in f
-                     for co in generatePointCoords(points[v])]
+                     for co in generatePointCoords(points[3 * v:3 * v + 3])]
 
         importMesh_ApplyTextureToLoops(bpymesh, bpyima, loops)
 
@@ -2436,11 +3282,39 @@ def importMesh_PointSet(geom, ancestry, _):
 GLOBALS['CIRCLE_DETAIL'] = 96
 
 
+def getMatrixScale(mtx):
+    # Largest axis scale of a world matrix, a local radius ends up at most this much bigger
+    return max(abs(s) for s in mtx.to_scale())
+
+
+def getCircleDetail(radius, scale=1.0):
+    # CIRCLE_DETAIL divisions, or with CHORD_ERROR set the fewest (at least 8)
+    # that keep the polygon within CHORD_ERROR of a circle of this radius.
+    # CHORD_ERROR is in world units, scale takes the local radius there.
+    n = GLOBALS['CIRCLE_DETAIL']
+    e = GLOBALS['CHORD_ERROR']
+    if not e:
+        return n
+    radius *= scale
+    n_min = min(8, n)
+    if e >= radius:
+        return n_min
+    return max(n_min, min(n, ceil(pi / acos(1.0 - e / radius))))
+
+
+def getSphereDetail(radius, scale=1.0):
+    # (rings, segments); rings span half the angle segments do
+    ns = getCircleDetail(radius, scale)
+    if not GLOBALS['CHORD_ERROR']:
+        return ns, ns
+    return max(2, (ns + 1) // 2), ns
+
+
 def importMesh_Sphere(geom, ancestry, bpyima):
     # solid is ignored.
     # Extra field 'subdivision="n m"' attribute, specifying how many
     # rings and segments to use (X3DOM).
-    r = geom.getFieldAsFloat('radius', 0.5, ancestry)
+    r, geom.parsed = vrml_geometry_radius(geom, ancestry, 0.5)
     subdiv = geom.getFieldAsArray('subdivision', 0, ancestry)
     if subdiv:
         if len(subdiv) == 1:
@@ -2448,74 +3322,125 @@ def importMesh_Sphere(geom, ancestry, bpyima):
         else:
             (nr, ns) = subdiv
     else:
-        nr = ns = GLOBALS['CIRCLE_DETAIL']
-        # used as both ring count and segment count
+        nr, ns = getSphereDetail(r, GLOBALS['SHAPE_SCALE'])
+    return makeMesh_Sphere(r, nr, ns, bpyima)
+
+
+# Unit sphere topology and texture coordinates for each (rings, segments),
+# built once and copied into every sphere mesh with foreach_set.
+sphere_templates = {}
+
+
+def getSphereTemplate(nr, ns):
+    template = sphere_templates.get((nr, ns))
+    if template is not None:
+        return template
+
     lau = pi / nr  # Unit angle of latitude (rings) for the given tesselation
     lou = 2 * pi / ns  # Unit angle of longitude (segments)
 
-    bpymesh = bpy.data.meshes.new(name="Sphere")
-
-    bpymesh.vertices.add(ns * (nr - 1) + 2)
     # The non-polar vertices go from x=0, negative z plane counterclockwise -
     # to -x, to +z, to +x, back to -z
-    co = [0, r, 0, 0, -r, 0]  # +y and -y poles
-    co += [r * coe for ring in range(1, nr) for seg in range(ns)
-           for coe in (-sin(lou * seg) * sin(lau * ring),
-                       cos(lau * ring),
-                       -cos(lou * seg) * sin(lau * ring))]
-    bpymesh.vertices.foreach_set('co', co)
+    co = array('f', (0, 1, 0, 0, -1, 0))  # +y and -y poles
+    co.extend(coe for ring in range(1, nr) for seg in range(ns)
+              for coe in (-sin(lou * seg) * sin(lau * ring),
+                          cos(lau * ring),
+                          -cos(lou * seg) * sin(lau * ring)))
 
-    tf = bpymesh.tessfaces
-    tf.add(ns * nr)
     vb = 2 + (nr - 2) * ns  # First vertex index for the bottom cap
-    fb = (nr - 1) * ns  # First face index for the bottom cap
-
-    # Because of tricky structure, assign texture coordinates along with
-    # face creation. Can't easily do foreach_set, 'cause caps are triangles and
-    # sides are quads.
-
-    if bpyima:
-        tex = bpymesh.tessface_uv_textures.new().data
-        for face in tex:  # No foreach_set for nonscalars
-            face.image = bpyima
+    loop_verts = array('i')
+    uv = array('f')
 
     # Faces go in order: top cap, sides, bottom cap.
     # Sides go by ring then by segment.
 
-    # Caps
     # Top cap face vertices go in order: down right up
     # (starting from +y pole)
-    # Bottom cap goes: up left down (starting from -y pole)
     for seg in range(ns):
-        tf[seg].vertices = (0, seg + 2, (seg + 1) % ns + 2)
-        tf[fb + seg].vertices = (1, vb + (seg + 1) % ns, vb + seg)
-        if bpyima:
-            tex[seg].uv = (((seg + 0.5) / ns, 1),
-                           (seg / ns, 1 - 1 / nr),
-                           ((seg + 1) / ns, 1 - 1 / nr))
-            tex[fb + seg].uv = (((seg + 0.5) / ns, 0),
-                                ((seg + 1) / ns, 1 / nr),
-                                (seg / ns, 1 / nr))
-
-    # Sides
+        loop_verts.extend((0, seg + 2, (seg + 1) % ns + 2))
+        uv.extend(((seg + 0.5) / ns, 1,
+                   seg / ns, 1 - 1 / nr,
+                   (seg + 1) / ns, 1 - 1 / nr))
+
     # Side face vertices go in order:  down right up left
     for ring in range(nr - 2):
         tvb = 2 + ring * ns
         # First vertex index for the top edge of the ring
         bvb = tvb + ns
         # First vertex index for the bottom edge of the ring
-        rfb = ns * (ring + 1)
-        # First face index for the ring
         for seg in range(ns):
             nseg = (seg + 1) % ns
-            tf[rfb + seg].vertices_raw = (tvb + seg, bvb + seg, bvb + nseg, tvb + nseg)
-            if bpyima:
-                tex[rfb + seg].uv_raw = (seg / ns, 1 - (ring + 1) / nr,
-                                         seg / ns, 1 - (ring + 2) / nr,
-                                         (seg + 1) / ns, 1 - (ring + 2) / nr,
-                                         (seg + 1) / ns, 1 - (ring + 1) / nr)
+            loop_verts.extend((tvb + seg, bvb + seg, bvb + nseg, tvb + nseg))
+            uv.extend((seg / ns, 1 - (ring + 1) / nr,
+                       seg / ns, 1 - (ring + 2) / nr,
+                       (seg + 1) / ns, 1 - (ring + 2) / nr,
+                       (seg + 1) / ns, 1 - (ring + 1) / nr))
+
+    # Bottom cap goes: up left down (starting from -y pole)
+    for seg in range(ns):
+        loop_verts.extend((1, vb + (seg + 1) % ns, vb + seg))
+        uv.extend(((seg + 0.5) / ns, 0,
+                   (seg + 1) / ns, 1 / nr,
+                   seg / ns, 1 / nr))
+
+    loop_totals = array('i', (3,)) * ns + array('i', (4,)) * (ns * (nr - 2)) + array('i', (3,)) * ns
+    loop_starts = array('i', (0,))
+    loop_starts.extend(itertools.accumulate(loop_totals[:-1]))
+
+    template = sphere_templates[(nr, ns)] = (co, loop_verts, loop_starts, loop_totals, uv)
+    return template
+
+
+# Unit meshes shared by makeMesh_Sphere() and makeMesh_Cylinder(), keyed by
+# (type, subdivision, caps); every shape gets a scaled copy.
+# Values are (mesh, uv loops). Removed from bpy.data after the import.
+primitive_meshes = {}
+
+
+def primitive_meshes_clear():
+    for bpymesh, uv in primitive_meshes.values():
+        try:
+            bpy.data.meshes.remove(bpymesh)
+        except ReferenceError:  # already gone with the file it was in
+            pass
+    primitive_meshes.clear()
+
+
+def makeUnitMesh_Sphere(nr, ns):
+    co, loop_verts, loop_starts, loop_totals, uv = getSphereTemplate(nr, ns)
+
+    bpymesh = bpy.data.meshes.new(name="Sphere")
+
+    bpymesh.vertices.add(len(co) // 3)
+    bpymesh.vertices.foreach_set('co', co)
+    bpymesh.loops.add(len(loop_verts))
+    bpymesh.loops.foreach_set('vertex_index', loop_verts)
+    bpymesh.polygons.add(len(loop_totals))
+    bpymesh.polygons.foreach_set('loop_start', loop_starts)
+    bpymesh.polygons.foreach_set('loop_total', loop_totals)
+    # The template is valid by construction, no validate() needed
+
+    bpymesh.update(calc_edges=True)
+    return bpymesh, uv
+
+
+def getUnitMesh_Sphere(nr, ns):
+    key = ('Sphere', nr, ns)
+    unit = primitive_meshes.get(key)
+    if unit is None:
+        unit = primitive_meshes[key] = makeUnitMesh_Sphere(nr, ns)
+    return unit
+
+
+def makeMesh_Sphere(r, nr, ns, bpyima):
+    unit_mesh, uv = getUnitMesh_Sphere(nr, ns)
+
+    bpymesh = unit_mesh.copy()
+    bpymesh.transform(Matrix.Scale(r, 4))
+
+    if bpyima:
+        importMesh_ApplyTextureToLoops(bpymesh, bpyima, uv)
 
-    bpymesh.validate(False)
     bpymesh.update()
     return bpymesh
 
@@ -2524,29 +3449,26 @@ def importMesh_Cylinder(geom, ancestry, bpyima):
     # solid is ignored
     # no ccw in this element
     # Extra parameter subdivision="n" - how many faces to use
-    radius = geom.getFieldAsFloat('radius', 1.0, ancestry)
+    radius, geom.parsed = vrml_geometry_radius(geom, ancestry, 1.0)
     height = geom.getFieldAsFloat('height', 2, ancestry)
     bottom = geom.getFieldAsBool('bottom', True, ancestry)
     top = geom.getFieldAsBool('top', True, ancestry)
     side = geom.getFieldAsBool('side', True, ancestry)
-    #Chimera outputs without top and bottom which are useful for interaction lists
-    #This makes sure they have top and bottom and that split cylinders touch
-    #Extra height was found empirically, but might need to change
-    if not bottom:
-        height = height+0.0005
-        bottom = True
-        top = True
-    
+    n = geom.getFieldAsInt('subdivision', None, ancestry)
+    if n is None:
+        n = getCircleDetail(radius, GLOBALS['SHAPE_SCALE'])
+    return makeMesh_Cylinder(radius, height, bottom, top, side, n, bpyima)
 
-    n = geom.getFieldAsInt('subdivision', GLOBALS['CIRCLE_DETAIL'], ancestry)
 
+def makeUnitMesh_Cylinder(n, bottom, top, side):
+    # Radius 1, height 1
     nn = n * 2
-    yvalues = (height / 2, -height / 2)
+    yvalues = (0.5, -0.5)
     angle = 2 * pi / n
 
     # The seam is at x=0, z=-r, vertices go ccw -
     # to pos x, to neg z, to neg x, back to neg z
-    verts = [(-radius * sin(angle * i), y, -radius * cos(angle * i))
+    verts = [(-sin(angle * i), y, -cos(angle * i))
              for i in range(n) for y in yvalues]
     faces = []
     if side:
@@ -2565,23 +3487,56 @@ def importMesh_Cylinder(geom, ancestry, bpyima):
     # the difference in performance on Blender 2.74 (Win64) is negligible.
 
     bpymesh.validate(False)
+    bpymesh.update()
 
     # Polygons here, not tessfaces
     # The structure of the loop array goes: cap, side, cap.
-    if bpyima:
-        loops = []
-        if side:
-            loops += [co for i in range(n)
-                      for co in ((i + 1) / n, 0, (i + 1) / n, 1, i / n, 1, i / n, 0)]
+    loops = []
+    if side:
+        loops += [co for i in range(n)
+                  for co in ((i + 1) / n, 0, (i + 1) / n, 1, i / n, 1, i / n, 0)]
+
+    if top:
+        loops += [0.5 + co / 2 for i in range(n)
+                  for co in (-sin(angle * i), cos(angle * i))]
 
-        if top:
-            loops += [0.5 + co / 2 for i in range(n)
-                      for co in (-sin(angle * i), cos(angle * i))]
+    if bottom:
+        loops += [0.5 - co / 2 for i in range(n - 1, -1, -1)
+                  for co in (sin(angle * i), cos(angle * i))]
 
-        if bottom:
-            loops += [0.5 - co / 2 for i in range(n - 1, -1, -1)
-                      for co in (sin(angle * i), cos(angle * i))]
+    return bpymesh, loops
+
+
+def fixCylinderCaps(height, bottom, top):
+    #Chimera outputs without top and bottom which are useful for interaction lists
+    #This makes sure they have top and bottom and that split cylinders touch
+    #Extra height was found empirically, but might need to change
+    if not bottom:
+        height = height+0.0005
+        bottom = True
+        top = True
+    return height, bottom, top
+
+
+def getUnitMesh_Cylinder(n, bottom, top, side):
+    key = ('Cylinder', n, bottom, top, side)
+    unit = primitive_meshes.get(key)
+    if unit is None:
+        unit = primitive_meshes[key] = makeUnitMesh_Cylinder(n, bottom, top, side)
+    return unit
 
+
+def makeMesh_Cylinder(radius, height, bottom, top, side, n, bpyima):
+    height, bottom, top = fixCylinderCaps(height, bottom, top)
+    unit_mesh, loops = getUnitMesh_Cylinder(n, bottom, top, side)
+
+    bpymesh = unit_mesh.copy()
+    bpymesh.transform(Matrix(((radius, 0, 0, 0),
+                              (0, height, 0, 0),
+                              (0, 0, radius, 0),
+                              (0, 0, 0, 1))))
+
+    if bpyima:
         importMesh_ApplyTextureToLoops(bpymesh, bpyima, loops)
 
     bpymesh.update()
@@ -2681,25 +3636,34 @@ def appearance_CreateMaterial(vrmlname, mat, ancestry, is_vcol):
     # Given an X3D material, creates a Blender material.
     # texture is applied later, in appearance_Create().
     # All values between 0.0 and 1.0, defaults from VRML docs.
+    return appearance_CreateMaterialFromValues(
+            vrmlname,
+            mat.getFieldAsFloat('ambientIntensity', 0.2, ancestry),
+            mat.getFieldAsFloatTuple('diffuseColor', [0.8, 0.8, 0.8], ancestry),
+            mat.getFieldAsFloatTuple('emissiveColor', [0.0, 0.0, 0.0], ancestry),
+            mat.getFieldAsFloat('shininess', 0.2, ancestry),
+            mat.getFieldAsFloatTuple('specularColor', [0.0, 0.0, 0.0], ancestry),
+            mat.getFieldAsFloat('transparency', 0.0, ancestry),
+            is_vcol)
+
+
+# Same as above from plain values, the molecular fast path has no Material node.
+def appearance_CreateMaterialFromValues(vrmlname, ambient, diff_color, emit,
+                                        shininess, specular_color, transparency,
+                                        is_vcol):
     bpymat = bpy.data.materials.new(vrmlname)
-    bpymat.ambient = mat.getFieldAsFloat('ambientIntensity', 0.2, ancestry)
-    diff_color = mat.getFieldAsFloatTuple('diffuseColor',
-                                          [0.8, 0.8, 0.8],
-                                          ancestry)
+    bpymat.ambient = ambient
     bpymat.diffuse_color = diff_color
 
     # NOTE - blender dosnt support emmisive color
     # Store in mirror color and approximate with emit.
-    emit = mat.getFieldAsFloatTuple('emissiveColor', [0.0, 0.0, 0.0], ancestry)
     bpymat.mirror_color = emit
     bpymat.emit = (emit[0] + emit[1] + emit[2]) / 3.0
 
-    shininess = mat.getFieldAsFloat('shininess', 0.2, ancestry)
     bpymat.specular_hardness = int(1 + (510 * shininess))
     # 0-1 -> 1-511
-    bpymat.specular_color = mat.getFieldAsFloatTuple('specularColor',
-                                                     [0.0, 0.0, 0.0], ancestry)
-    bpymat.alpha = 1.0 - mat.getFieldAsFloat('transparency', 0.0, ancestry)
+    bpymat.specular_color = specular_color
+    bpymat.alpha = 1.0 - transparency
     if bpymat.alpha < 0.999:
         bpymat.use_transparency = True
     if is_vcol:
@@ -2829,14 +3793,13 @@ def appearance_MakeDescCacheKey(material, tex_node):
 
     if not((tex_node and tex_desc is None) or
            (material and mat_desc is None)):
-        # desc not available (in VRML)
-        # TODO: serialize VRML nodes!!!
         return (mat_desc, tex_desc)
     elif not tex_node and not material:
         # Even for VRML, we cache the null material
         return ("Default", "Default")
     else:
-        return None  # Desc-based caching is off
+        # desc not available (VRML textures, IS fields), desc-based caching is off
+        return None
 
 
 def appearance_Create(vrmlname, material, tex_node, ancestry, node, is_vcol):
@@ -3038,11 +4001,9 @@ def importShape_ProcessObject(
     bpyob = node.blendObject = bpy.data.objects.new(vrmlname, bpydata)
     bpyob.matrix_world = getFinalMatrix(node, None, ancestry, global_matrix)
     bpyob["ptype"] = geom_spec
-    try:
-    	bpyob["radius"] = geom.getFieldAsFloat('radius', None, ancestry)
-    except:
-    	bpyob["radius"] = 0
-    bpyscene.objects.link(bpyob).select = True
+    # "radius" property from importMesh_Sphere/importMesh_Cylinder, 0 without a radius field
+    bpyob["radius"] = geom.parsed if geom_spec in {'Sphere', 'Cylinder'} else 0
+    new_objects.append(bpyob)
 
     if DEBUG:
         bpyob["source_line_no"] = geom.lineno
@@ -3085,6 +4046,27 @@ geometry_importers = {
     }
 
 
+# Objects made by importShape() and importPrimitiveTable(), linked to the
+# scene together by linkNewObjects()
+new_objects = []
+
+
+def linkNewObjects(bpyscene):
+    profiler = GLOBALS['PROFILER']
+    if profiler:
+        token = profiler.begin()
+
+    link = bpyscene.objects.link
+    exporter = GLOBALS['EXPORTER']
+    for bpyob in new_objects:
+        bpyob["exporter"] = exporter
+        link(bpyob).select = True
+    new_objects.clear()
+
+    if profiler:
+        profiler.end('object link', token)
+
+
 def importShape(bpyscene, node, ancestry, global_matrix):
     # Under Shape, we can only have Appearance, MetadataXXX and a geometry node
     def isGeometry(spec):
@@ -3096,7 +4078,7 @@ def importShape(bpyscene, node, ancestry, global_matrix):
         bpyob = node.blendData = node.blendObject = bpyob.copy()
         # Could transform data, but better the object so we can instance the data
         bpyob.matrix_world = getFinalMatrix(node, None, ancestry, global_matrix)
-        bpyscene.objects.link(bpyob).select = True
+        new_objects.append(bpyob)
         return
 
     vrmlname = node.getDefName()
@@ -3116,7 +4098,12 @@ def importShape(bpyscene, node, ancestry, global_matrix):
 
     is_vcol = (geom.getChildBySpec(['Color', 'ColorRGBA']) is not None)
 
+    profiler = GLOBALS['PROFILER']
+
     if appr:
+        if profiler:
+            token = profiler.begin()
+
         (bpymat, bpyima,
          tex_has_alpha) = importShape_LoadAppearance(vrmlname, appr,
                                                      ancestry, node,
@@ -3126,6 +4113,9 @@ def importShape(bpyscene, node, ancestry, global_matrix):
         if textx:
             texmtx = translateTexTransform(textx, ancestry)
 
+        if profiler:
+            profiler.end('materials', token)
+
     bpydata = None
     geom_spec = geom.getSpec()
 
@@ -3133,7 +4123,18 @@ def importShape(bpyscene, node, ancestry, global_matrix):
     # geometries are easier to flip than others
     geom_fn = geometry_importers.get(geom_spec)
     if geom_fn is not None:
+        if profiler:
+            token = profiler.begin()
+
+        if GLOBALS['CHORD_ERROR']:
+            # Detail from the size the shape ends up, not its local radius
+            GLOBALS['SHAPE_SCALE'] = getMatrixScale(getFinalMatrix(node, None, ancestry, global_matrix))
         bpydata = geom_fn(geom, ancestry, bpyima)
+        GLOBALS['SHAPE_SCALE'] = 1.0
+
+        if profiler:
+            profiler.end('mesh build', token)
+            token = profiler.begin()
 
         # There are no geometry importers that can legally return
         # no object.  It's either a bpy object, or an exception
@@ -3141,10 +4142,291 @@ def importShape(bpyscene, node, ancestry, global_matrix):
                 bpyscene, vrmlname, bpydata, geom, geom_spec,
                 node, bpymat, tex_has_alpha, texmtx,
                 ancestry, global_matrix)
+
+        if profiler:
+            profiler.end('object create', token)
     else:
         print('\tImportX3D warning: unsupported type "%s"' % geom_spec)
 
 
+def importPrimitiveTable(bpyscene, table, global_matrix):
+    # importShape() for the rows read by vrml_read_primitives(), same
+    # object names and properties as the generic path.
+    profiler = GLOBALS['PROFILER']
+    if profiler:
+        token = profiler.begin()
+
+    bpymats = [appearance_CreateMaterialFromValues('Shape', *values, is_vcol=False)
+               if values else appearance_CreateDefaultMaterial()
+               for values in table.materials]
+
+    if profiler:
+        profiler.end('materials', token)
+
+    matrices = table.matrices
+    for j, ptype in enumerate(table.ptypes):
+        radius = table.radii[j]
+        flags = table.flags[j]
+        if profiler:
+            token = profiler.begin()
+
+        mtx = matrices[16 * j:16 * j + 16].tolist()  # array or cached memoryview
+        mtx = global_matrix * Matrix((mtx[0:4], mtx[4:8], mtx[8:12], mtx[12:16]))
+        scale = getMatrixScale(mtx)
+
+        if ptype == PRIM_SPHERE:
+            nr, ns = getSphereDetail(radius, scale)
+            bpydata = makeMesh_Sphere(radius, nr, ns, None)
+        else:
+            bpydata = makeMesh_Cylinder(radius, table.heights[j],
+                                        bool(flags & PRIM_BOTTOM),
+                                        bool(flags & PRIM_TOP),
+                                        bool(flags & PRIM_SIDE),
+                                        getCircleDetail(radius, scale), None)
+
+        if profiler:
+            profiler.end('mesh build', token)
+            token = profiler.begin()
+
+        geom_spec = PRIM_SPECS[ptype]
+        vrmlname = "Shape_" + geom_spec
+        bpydata.name = vrmlname
+
+        material_id = table.material_ids[j]
+        if material_id != -1:
+            bpydata.materials.append(bpymats[material_id])
+
+        bpyob = bpy.data.objects.new(vrmlname, bpydata)
+        bpyob.matrix_world = mtx
+        bpyob["ptype"] = geom_spec
+        bpyob["radius"] = primitive_radius_property(radius, flags)
+        new_objects.append(bpyob)
+
+        if profiler:
+            profiler.end('object create', token)
+
+    linkNewObjects(bpyscene)
+
+
+# Name of the text blocks merged imports keep their primitives in, one per
+# import (Blender numbers the later ones), the merged objects keep its name in "primitive_table"
+PRIMITIVE_TABLE_TEXT = "molprint_primitives"
+
+
+def importPrimitiveTableMerged(bpyscene, table, global_matrix):
+    # One object per primitive class instead of one per row. Each polygon
+    # has the row it came from in the "prim_id" layer and its radius in the
+    # "radius" layer; the rows themselves go to a JSON text block of this
+    # import, which splitPrimitives() rebuilds separate objects from.
+    profiler = GLOBALS['PROFILER']
+    if profiler:
+        token = profiler.begin()
+
+    bpymats = [appearance_CreateMaterialFromValues('Shape', *values, is_vcol=False)
+               if values else appearance_CreateDefaultMaterial()
+               for values in table.materials]
+
+    if profiler:
+        profiler.end('materials', token)
+
+    text = bpy.data.texts.new(PRIMITIVE_TABLE_TEXT)
+    matrices = table.matrices
+    records = []
+    rows = {}  # ptype: [row, ...]
+    for j, ptype in enumerate(table.ptypes):
+        rows.setdefault(ptype, []).append(j)
+
+    for ptype, ptype_rows in sorted(rows.items()):
+        if profiler:
+            token = profiler.begin()
+
+        geom_spec = PRIM_SPECS[ptype]
+        co = array('f')
+        loop_verts = array('i')
+        loop_totals = array('i')
+        prim_ids = array('i')
+        radii = array('f')
+        material_index = array('i')
+        slots = {}  # material id: slot index
+        units = {}  # unit mesh name: (scratch mesh, co, loops, totals)
+
+        for j in ptype_rows:
+            radius = table.radii[j]
+            height = table.heights[j]
+            flags = table.flags[j]
+
+            mtx = matrices[16 * j:16 * j + 16].tolist()  # array or cached memoryview
+            mtx = global_matrix * Matrix((mtx[0:4], mtx[4:8], mtx[8:12], mtx[12:16]))
+            scale = getMatrixScale(mtx)
+
+            if ptype == PRIM_SPHERE:
+                unit_mesh = getUnitMesh_Sphere(*getSphereDetail(radius, scale))[0]
+                sca = Matrix.Scale(radius, 4)
+            else:
+                height, bottom, top = fixCylinderCaps(height,
+                                                      bool(flags & PRIM_BOTTOM),
+                                                      bool(flags & PRIM_TOP))
+                unit_mesh = getUnitMesh_Cylinder(getCircleDetail(radius, scale), bottom, top,
+                                                 bool(flags & PRIM_SIDE))[0]
+                sca = Matrix(((radius, 0, 0, 0),
+                              (0, height, 0, 0),
+                              (0, 0, radius, 0),
+                              (0, 0, 0, 1)))
+
+            unit = units.get(unit_mesh.name)
+            if unit is None:
+                unit_co = array('f', [0.0]) * (len(unit_mesh.vertices) * 3)
+                unit_mesh.vertices.foreach_get('co', unit_co)
+                unit_loops = array('i', [0]) * len(unit_mesh.loops)
+                unit_mesh.loops.foreach_get('vertex_index', unit_loops)
+                unit_totals = array('i', [0]) * len(unit_mesh.polygons)
+                unit_mesh.polygons.foreach_get('loop_total', unit_totals)
+                unit = units[unit_mesh.name] = (unit_mesh.copy(), unit_co, unit_loops, unit_totals)
+            scratch, unit_co, unit_loops, unit_totals = unit
+
+            # Let Blender transform the vertices, then take them back
+            scratch.vertices.foreach_set('co', unit_co)
+            scratch.transform(mtx * sca)
+            row_co = array('f', unit_co)
+            scratch.vertices.foreach_get('co', row_co)
+
+            loop_verts.extend(map((len(co) // 3).__add__, unit_loops))
+            co.extend(row_co)
+            loop_totals.extend(unit_totals)
+            n_polys = len(unit_totals)
+            prim_ids.extend(array('i', [j]) * n_polys)
+            radii.extend(array('f', [radius]) * n_polys)
+
+            material_id = table.material_ids[j]
+            slot = slots.get(material_id)
+            if slot is None:
+                slot = slots[material_id] = len(slots)
+            material_index.extend(array('i', [slot]) * n_polys)
+
+            records.append({'id': j,
+                            'ptype': geom_spec,
+                            'radius': radius,
+                            'height': table.heights[j],
+                            'flags': flags,
+                            'material': bpymats[material_id].name if material_id != -1 else None,
+                            'matrix': [v for row in mtx for v in row],
+                            })
+
+        for scratch, unit_co, unit_loops, unit_totals in units.values():
+            bpy.data.meshes.remove(scratch)
+
+        loop_starts = array('i', [0])
+        loop_starts.extend(itertools.accumulate(loop_totals[:-1]))
+
+        vrmlname = "Shape_" + geom_spec
+        bpydata = bpy.data.meshes.new(vrmlname)
+        bpydata.vertices.add(len(co) // 3)
+        bpydata.vertices.foreach_set('co', co)
+        bpydata.loops.add(len(loop_verts))
+        bpydata.loops.foreach_set('vertex_index', loop_verts)
+        bpydata.polygons.add(len(loop_totals))
+        bpydata.polygons.foreach_set('loop_start', loop_starts)
+        bpydata.polygons.foreach_set('loop_total', loop_totals)
+        bpydata.polygons.foreach_set('material_index', material_index)
+        bpydata.polygon_layers_int.new("prim_id").data.foreach_set('value', prim_ids)
+        bpydata.polygon_layers_float.new("radius").data.foreach_set('value', radii)
+
+        for material_id, slot in sorted(slots.items(), key=lambda item: item[1]):
+            bpydata.materials.append(bpymats[material_id] if material_id != -1 else None)
+
+        bpydata.update(calc_edges=True)
+
+        if profiler:
+            profiler.end('mesh build', token)
+            token = profiler.begin()
+
+        bpyob = bpy.data.objects.new(vrmlname, bpydata)
+        bpyob["ptype"] = geom_spec
+        bpyob["merged"] = True
+        bpyob["primitive_table"] = text.name
+        bpyob["exporter"] = GLOBALS['EXPORTER']
+        bpyscene.objects.link(bpyob).select = True
+
+        if profiler:
+            profiler.end('object link', token)
+
+    text.from_string(json.dumps({'circle_detail': GLOBALS['CIRCLE_DETAIL'],
+                                 'chord_error': GLOBALS['CHORD_ERROR'],
+                                 'primitives': records,
+                                 }))
+
+
+def splitPrimitives(bpyscene, bpyob, prim_ids):
+    # Take the rows in prim_ids out of a merged object (see
+    # importPrimitiveTableMerged) and give each its own object, as
+    # importPrimitiveTable would have made it. Returns the new objects.
+    text = bpy.data.texts.get(bpyob.get("primitive_table", ""))
+    if text is None or not prim_ids:
+        return []
+    data = json.loads(text.as_string())
+    records = {record['id']: record for record in data['primitives']}
+
+    circle_detail = GLOBALS['CIRCLE_DETAIL']
+    chord_error = GLOBALS['CHORD_ERROR']
+    GLOBALS['CIRCLE_DETAIL'] = data['circle_detail']
+    GLOBALS['CHORD_ERROR'] = data['chord_error']
+
+    new_objects = []
+    for j in sorted(prim_ids):
+        record = records.get(j)
+        if record is None:
+            continue
+        radius = record['radius']
+        flags = record['flags']
+        mtx = record['matrix']
+        mtx = Matrix((mtx[0:4], mtx[4:8], mtx[8:12], mtx[12:16]))
+        scale = getMatrixScale(mtx)
+        if record['ptype'] == PRIM_SPECS[PRIM_SPHERE]:
+            bpydata = makeMesh_Sphere(radius, *getSphereDetail(radius, scale), None)
+        else:
+            bpydata = makeMesh_Cylinder(radius, record['height'],
+                                        bool(flags & PRIM_BOTTOM),
+                                        bool(flags & PRIM_TOP),
+                                        bool(flags & PRIM_SIDE),
+                                        getCircleDetail(radius, scale), None)
+
+        vrmlname = "Shape_" + record['ptype']
+        bpydata.name = vrmlname
+        if record['material'] is not None:
+            bpydata.materials.append(bpy.data.materials.get(record['material']))
+
+        bpyob_new = bpy.data.objects.new(vrmlname, bpydata)
+        bpyob_new.matrix_world = mtx
+        bpyob_new["ptype"] = record['ptype']
+        bpyob_new["radius"] = primitive_radius_property(radius, flags)
+        bpyob_new["exporter"] = bpyob.get("exporter", 'unknown')
+        bpyscene.objects.link(bpyob_new).select = True
+        new_objects.append(bpyob_new)
+
+    GLOBALS['CIRCLE_DETAIL'] = circle_detail
+    GLOBALS['CHORD_ERROR'] = chord_error
+    primitive_meshes_clear()
+
+    # Drop their polygons from the merged mesh
+    bm = bmesh.new()
+    bm.from_mesh(bpyob.data)
+    layer = bm.faces.layers.int.get("prim_id")
+    if layer is not None:
+        split = set(prim_ids)
+        bmesh.ops.delete(bm, geom=[f for f in bm.faces if f[layer] in split], context=5)  # DEL_FACES
+        bm.to_mesh(bpyob.data)
+    bm.free()
+    bpyob.data.update()
+
+    if not bpyob.data.polygons:
+        # All split out, an empty merged object would only block the tools
+        bpydata = bpyob.data
+        bpy.data.objects.remove(bpyob, do_unlink=True)
+        bpy.data.meshes.remove(bpydata)
+
+    return new_objects
+
+
 # -----------------------------------------------------------------------------------
 # Lighting
 
@@ -3470,150 +4752,251 @@ def load_web3d(
         *,
         PREF_FLAT=False,
         PREF_CIRCLE_DIV=16,
+        PREF_CHORD_ERROR=None,
+        PREF_CACHE_DIR=None,
+        PREF_MERGE=False,
+        PROFILER=None,
+        REPORT=None,
         global_matrix=None,
         HELPER_FUNC=None
         ):
 
     # Used when adding blender primitives
     GLOBALS['CIRCLE_DETAIL'] = PREF_CIRCLE_DIV
+    GLOBALS['SHAPE_SCALE'] = 1.0
+    GLOBALS['CHORD_ERROR'] = PREF_CHORD_ERROR
+    GLOBALS['EXPORTER'] = vrml_sniff_exporter(filepath)
+    GLOBALS['PROFILER'] = PROFILER
+    transform_cache.clear()
+    primitive_meshes_clear()
+    new_objects.clear()
 
-    #root_node = vrml_parse('/_Cylinder.wrl')
-    if filepath.lower().endswith('.x3d'):
-        root_node, msg = x3d_parse(filepath)
-    else:
-        root_node, msg = vrml_parse(filepath)
+    try:
+        if global_matrix is None:
+            global_matrix = Matrix()
 
-    if not root_node:
-        print(msg)
-        return
+        #root_node = vrml_parse('/_Cylinder.wrl')
+        if PROFILER:
+            token = PROFILER.begin()
+
+        if filepath.lower().endswith('.x3d'):
+            root_node, msg = x3d_parse(filepath)
+
+            if PROFILER:
+                PROFILER.end('parse', token)
+                PROFILER.notes['import_path'] = 'x3d'
+        else:
+            # Ball and stick files skip the node tree, unless a hierarchy or
+            # the helper needs the nodes
+            use_primitives = PREF_FLAT and HELPER_FUNC is None
+
+            table = lines = cache_key = None
+            if use_primitives and PREF_CACHE_DIR:
+                cache_key = primitive_cache_key(filepath)
+                if cache_key:
+                    table = primitive_cache_load(PREF_CACHE_DIR, cache_key)
+
+                if PROFILER:
+                    PROFILER.end('read', token)
+                    PROFILER.notes['import_path'] = 'cache' if table is not None else 'primitives'
+
+            if table is None:
+                lines = vrml_read(filepath, PROFILER)
+                if lines is None:
+                    print('Failed to open file: ' + filepath)
+                    return
+
+                if use_primitives:
+                    if PROFILER:
+                        token = PROFILER.begin()
+
+                    table = vrml_read_primitives(lines)
+                    if table is not None and cache_key:
+                        primitive_cache_save(PREF_CACHE_DIR, cache_key, table)
+
+                    if PROFILER:
+                        PROFILER.end('parse', token)
+                        PROFILER.notes['import_path'] = 'primitives'
+
+            if table is not None:
+                if PREF_MERGE:
+                    importPrimitiveTableMerged(bpyscene, table, global_matrix)
+                else:
+                    importPrimitiveTable(bpyscene, table, global_matrix)
+                bpyscene.update()
+                return
 
-    if global_matrix is None:
-        global_matrix = Matrix()
+            if PROFILER:
+                token = PROFILER.begin()
 
-    # fill with tuples - (node, [parents-parent, parent])
-    all_nodes = root_node.getSerialized([], [])
+            root_node, msg = vrml_parse(filepath, lines)
 
-    for node, ancestry in all_nodes:
-        #if 'castle.wrl' not in node.getFilename():
-        #   continue
+            if PROFILER:
+                PROFILER.end('parse', token)
+                PROFILER.notes['import_path'] = 'generic'
 
-        spec = node.getSpec()
-        '''
-        prefix = node.getPrefix()
-        if prefix=='PROTO':
-            pass
-        else
-        '''
-        if HELPER_FUNC and HELPER_FUNC(node, ancestry):
-            # Note, include this function so the VRML/X3D importer can be extended
-            # by an external script. - gets first pick
-            pass
-        if spec == 'Shape':
-            importShape(bpyscene, node, ancestry, global_matrix)
-        elif spec in {'PointLight', 'DirectionalLight', 'SpotLight'}:
-            importLamp(bpyscene, node, spec, ancestry, global_matrix)
-        elif spec == 'Viewpoint':
-            importViewpoint(bpyscene, node, ancestry, global_matrix)
-        elif spec == 'Transform':
-            # Only use transform nodes when we are not importing a flat object hierarchy
-            if PREF_FLAT == False:
-                importTransform(bpyscene, node, ancestry, global_matrix)
+        if not root_node:
+            print(msg)
+            return
+
+        if PREF_MERGE:
+            msg = 'merge only works for ball and stick VRML files, importing separate objects'
+            print('\tImportX3D warning: ' + msg)
+            if REPORT:
+                REPORT({'WARNING'}, msg.capitalize())
+
+        if PROFILER:
+            token = PROFILER.begin()
+
+        # fill with tuples - (node, [parents-parent, parent])
+        all_nodes = root_node.getSerialized([], [])
+
+        if PROFILER:
+            PROFILER.end('serialize', token)
+
+        for node, ancestry in all_nodes:
+            #if 'castle.wrl' not in node.getFilename():
+            #   continue
+
+            spec = node.getSpec()
             '''
-        # These are delt with later within importRoute
-        elif spec=='PositionInterpolator':
-            action = bpy.data.ipos.new('web3d_ipo', 'Object')
-            translatePositionInterpolator(node, action)
+            prefix = node.getPrefix()
+            if prefix=='PROTO':
+                pass
+            else
             '''
+            if HELPER_FUNC and HELPER_FUNC(node, ancestry):
+                # Note, include this function so the VRML/X3D importer can be extended
+                # by an external script. - gets first pick
+                pass
+            if spec == 'Shape':
+                importShape(bpyscene, node, ancestry, global_matrix)
+            elif spec in {'PointLight', 'DirectionalLight', 'SpotLight'}:
+                importLamp(bpyscene, node, spec, ancestry, global_matrix)
+            elif spec == 'Viewpoint':
+                importViewpoint(bpyscene, node, ancestry, global_matrix)
+            elif spec == 'Transform':
+                # Only use transform nodes when we are not importing a flat object hierarchy
+                if PREF_FLAT == False:
+                    importTransform(bpyscene, node, ancestry, global_matrix)
+                '''
+            # These are delt with later within importRoute
+            elif spec=='PositionInterpolator':
+                action = bpy.data.ipos.new('web3d_ipo', 'Object')
+                translatePositionInterpolator(node, action)
+                '''
+
+        # All shapes at once, then one scene update below
+        linkNewObjects(bpyscene)
+
+        # After we import all nodes, route events - anim paths
+        for node, ancestry in all_nodes:
+            importRoute(node, ancestry)
+
+        for node, ancestry in all_nodes:
+            if node.isRoot():
+                # we know that all nodes referenced from will be in
+                # routeIpoDict so no need to run node.getDefDict() for every node.
+                routeIpoDict = node.getRouteIpoDict()
+                defDict = node.getDefDict()
 
-    # After we import all nodes, route events - anim paths
-    for node, ancestry in all_nodes:
-        importRoute(node, ancestry)
+                for key, action in routeIpoDict.items():
 
-    for node, ancestry in all_nodes:
-        if node.isRoot():
-            # we know that all nodes referenced from will be in
-            # routeIpoDict so no need to run node.getDefDict() for every node.
-            routeIpoDict = node.getRouteIpoDict()
-            defDict = node.getDefDict()
+                    # Assign anim curves
+                    node = defDict[key]
+                    if node.blendData is None:  # Add an object if we need one for animation
+                        node.blendData = node.blendObject = bpy.data.objects.new('AnimOb', None)  # , name)
+                        bpyscene.objects.link(node.blendObject).select = True
 
-            for key, action in routeIpoDict.items():
+                    if node.blendData.animation_data is None:
+                        node.blendData.animation_data_create()
 
-                # Assign anim curves
-                node = defDict[key]
-                if node.blendData is None:  # Add an object if we need one for animation
-                    node.blendData = node.blendObject = bpy.data.objects.new('AnimOb', None)  # , name)
-                    bpyscene.objects.link(node.blendObject).select = True
+                    node.blendData.animation_data.action = action
 
-                if node.blendData.animation_data is None:
-                    node.blendData.animation_data_create()
+        # Add in hierarchy
+        if PREF_FLAT is False:
+            child_dict = {}
+            for node, ancestry in all_nodes:
+                if node.blendObject:
+                    blendObject = None
 
-                node.blendData.animation_data.action = action
+                    # Get the last parent
+                    i = len(ancestry)
+                    while i:
+                        i -= 1
+                        blendObject = ancestry[i].blendObject
+                        if blendObject:
+                            break
 
-    # Add in hierarchy
-    if PREF_FLAT is False:
-        child_dict = {}
-        for node, ancestry in all_nodes:
-            if node.blendObject:
-                blendObject = None
-
-                # Get the last parent
-                i = len(ancestry)
-                while i:
-                    i -= 1
-                    blendObject = ancestry[i].blendObject
                     if blendObject:
-                        break
+                        # Parent Slow, - 1 liner but works
+                        # blendObject.makeParent([node.blendObject], 0, 1)
 
-                if blendObject:
-                    # Parent Slow, - 1 liner but works
-                    # blendObject.makeParent([node.blendObject], 0, 1)
+                        # Parent FAST
+                        try:
+                            child_dict[blendObject].append(node.blendObject)
+                        except:
+                            child_dict[blendObject] = [node.blendObject]
 
-                    # Parent FAST
-                    try:
-                        child_dict[blendObject].append(node.blendObject)
-                    except:
-                        child_dict[blendObject] = [node.blendObject]
+            # Parent
+            for parent, children in child_dict.items():
+                for c in children:
+                    c.parent = parent
 
-        # Parent
-        for parent, children in child_dict.items():
-            for c in children:
-                c.parent = parent
+            del child_dict
 
         # update deps
         bpyscene.update()
-        del child_dict
-
-
-def load_with_profiler(
-        context,
-        filepath,
-        *,
-        global_matrix=None
-        ):
-    import cProfile
-    import pstats
-    pro = cProfile.Profile()
-    pro.runctx("load_web3d(context.scene, filepath, PREF_FLAT=True, "
-               "PREF_CIRCLE_DIV=16, global_matrix=global_matrix)",
-               globals(), locals())
-    st = pstats.Stats(pro)
-    st.sort_stats("time")
-    st.print_stats(0.1)
-    # st.print_callers(0.1)
+    finally:
+        # On every return, the unit meshes were only scratch data for the shapes
+        transform_cache.clear()  # dont keep the nodes alive
+        primitive_meshes_clear()
+        GLOBALS['PROFILER'] = None  # a later import without profiling must not write to it
 
 
 def load(context,
          filepath,
          *,
          PREF_CIRCLE_DIV=16,
-         global_matrix=None
+         PREF_CHORD_ERROR=None,
+         global_matrix=None,
+         use_cache=True,
+         clear_cache=False,
+         use_profiler=False,
+         merge=False,
+         report=None
          ):
 
-    # loadWithProfiler(operator, context, filepath, global_matrix)
+    cache_dir = None
+    if use_cache or clear_cache:
+        cache_dir = bpy.utils.user_resource('DATAFILES', path="molprint_cache", create=True)
+        if clear_cache:
+            primitive_cache_clear(cache_dir)
+
+    # Report next to the input file: where the time and memory of the import went
+    profiler = importProfiler() if use_profiler else None
+    objects_before = len(context.scene.objects)
+
     load_web3d(context.scene, filepath,
                PREF_FLAT=True,
                PREF_CIRCLE_DIV=PREF_CIRCLE_DIV,
+               PREF_CHORD_ERROR=PREF_CHORD_ERROR,
+               PREF_CACHE_DIR=cache_dir if use_cache else None,
+               PREF_MERGE=merge,
+               PROFILER=profiler,
+               REPORT=report,
                global_matrix=global_matrix,
                )
 
+    if profiler:
+        profiler.notes['file'] = filepath
+        profiler.notes['circle_detail'] = PREF_CIRCLE_DIV
+        profiler.notes['chord_error'] = PREF_CHORD_ERROR
+        profiler.notes['exporter'] = GLOBALS['EXPORTER']
+        profiler.notes['objects'] = len(context.scene.objects) - objects_before  # linked by this import
+        try:
+            profiler.write(filepath + '.profile.json')
+        except OSError as e:
+            print('\tWarning: could not write the import profile:', e)
+
     return {'FINISHED'}
@@ -26,6 +26,7 @@ import bpy
 import bmesh
 import math
 import mathutils
+import mathutils.kdtree
 import itertools
 import random
 import time
@@ -33,9 +34,11 @@ import copy
 import addon_utils
 from mathutils.bvhtree import BVHTree
 from mathutils import Matrix, Vector
-from collections import Counter
+from collections import Counter, OrderedDict
 from decimal import *
 
+from . import geometry
+
 
 def loadpins():
     filepath = bpy.context.scene.molprint_lists.directory + "/test.blend"
@@ -88,10 +91,45 @@ def makestrut(obj1, obj2):
     '''
 
 
+def delete_objects(objs):
+    '''Remove objects through bpy.data in one pass, no selection or operators,
+    then the meshes they leave without users. Objects already removed are skipped'''
+    meshes = set()
+    for ob in objs:
+        try:
+            data = ob.data
+        except ReferenceError:
+            continue
+        if isinstance(data, bpy.types.Mesh):
+            meshes.add(data.name)
+        bpy.data.objects.remove(ob, do_unlink=True)
+
+    for name in meshes:
+        me = bpy.data.meshes.get(name)
+        if me is not None and me.users == 0:
+            bpy.data.meshes.remove(me)
+
+
+def make_single_user(objs):
+    '''Give objects their own copy of mesh data they share with other objects.
+    Jmol files USE the same shape many times, the importer keeps those
+    as linked duplicates until something is about to edit the mesh'''
+    for ob in objs:
+        if ob.data is not None and ob.data.users > 1:
+            ob.data = ob.data.copy()
+
+
+def merged_objects(objs):
+    '''Objects from a merged import. They hold all atoms or all bonds of a file in
+    one mesh at the origin, the tools only understand them once split out (Split Merged)'''
+    return [ob for ob in objs if ob.get("merged", False)]
+
+
 def scalebonds(scale_val):
     for obj in bpy.context.scene.objects:
         bpy.ops.object.select_all(action='DESELECT')
         if obj["ptype"] == 'Cylinder' and obj["hbond"] == 0:
+            make_single_user([obj])
             obj.select = True
             # scale the object
             obj.scale = (scale_val, 1, scale_val)
@@ -235,17 +273,45 @@ def bmesh_copy_from_object(obj, transform=True, triangulate=False, apply_modifie
     return bm
 
 
+# World space BVH trees by object, least recently used first.
+# Keyed by what would make a tree stale: name, mesh, matrix and element counts
+bvh_cache = OrderedDict()
+BVH_CACHE_SIZE = 512
+
+
+def bvh_cache_clear():
+    bvh_cache.clear()
+
+
+def object_bvh(obj):
+    if obj.mode == 'EDIT':  # edit mesh may differ from the counts
+        bm = bmesh_copy_from_object(obj, transform=True, triangulate=False)
+        tree = BVHTree.FromBMesh(bm)
+        bm.free()
+        return tree
+
+    me = obj.data
+    key = (obj.name, me.name, tuple(v for row in obj.matrix_world for v in row),
+           len(me.vertices), len(me.polygons))
+    tree = bvh_cache.get(key)
+    if tree is not None:
+        bvh_cache.move_to_end(key)
+        return tree
+
+    bm = bmesh_copy_from_object(obj, transform=True, triangulate=False)
+    tree = bvh_cache[key] = BVHTree.FromBMesh(bm)
+    bm.free()
+    if len(bvh_cache) > BVH_CACHE_SIZE:
+        bvh_cache.popitem(last=False)
+    return tree
+
+
 def bmesh_check_intersect_objects(obj, obj2, selectface=False):
     assert (obj != obj2)
-    # Triangulate in most cases, not if using CPK matching
-    tris = False
-    if selectface:
-        tris = False
-    bm = bmesh_copy_from_object(obj, transform=True, triangulate=tris)
-    bm2 = bmesh_copy_from_object(obj2, transform=True, triangulate=tris)
+    # Not triangulated, so tree indices are polygon indices for CPK matching
     intersect = False
-    BMT1 = BVHTree.FromBMesh(bm)
-    BMT2 = BVHTree.FromBMesh(bm2)
+    BMT1 = object_bvh(obj)
+    BMT2 = object_bvh(obj2)
     overlap_pairs = BMT1.overlap(BMT2)
 
     if len(overlap_pairs) > 0:
@@ -268,12 +334,81 @@ def bmesh_check_intersect_objects(obj, obj2, selectface=False):
             obj2.data.polygons[each[1]].select = True
             obj2.update_from_editmode()
 
-    bm.free()
-    bm2.free()
-
     return intersect
 
 
+def primitive_shape(ob):
+    '''Exact shape of an imported sphere or cylinder nothing has cut or joined yet:
+    ('Sphere', center, radius) or ('Cylinder', (cap, cap), radius) in world space.
+    None for anything else, those need bmesh_check_intersect_objects'''
+    ptype = ob.get("ptype")
+    if ptype not in {'Sphere', 'Cylinder'} or "exporter" not in ob or ob.modifiers:
+        return None
+    me = ob.data
+    nv = len(me.vertices)
+    nf = len(me.polygons)
+
+    if ptype == 'Sphere':
+        # ns * (rings - 1) + 2 vertices, ns * rings faces
+        ns = nf - nv + 2
+        if ns < 3 or nf % ns:
+            return None
+        bb = ob.bound_box
+        lo = Vector([min(v[i] for v in bb) for i in range(3)])
+        hi = Vector([max(v[i] for v in bb) for i in range(3)])
+        center = ob.matrix_world * ((lo + hi) / 2)
+        radius = (hi.x - lo.x) / 2 * max(abs(s) for s in ob.matrix_world.to_scale())
+        return ptype, center, radius
+
+    # Quad sides and two n-gon caps, one cylinder or two merged halves
+    sizes = [0] * nf
+    me.polygons.foreach_get('loop_total', sizes)
+    sides = sizes.count(4)
+    if sides + 2 != nf or 2 * nv not in (4 * sides, 3 * sides):
+        return None
+    caps, axis, radius = cylinder_caps(ob)
+    return ptype, caps, radius
+
+
+def primitives_touch(shape1, shape2):
+    '''Closed form bmesh_check_intersect_objects for two primitive_shape()s:
+    True when the surfaces cross, not when one is wholly inside the other.
+    None for two cylinders'''
+    if shape1[0] == 'Cylinder':
+        shape1, shape2 = shape2, shape1
+    if shape1[0] != 'Sphere':
+        return None
+    ptype, center, rs = shape1
+
+    if shape2[0] == 'Sphere':
+        distance = (shape2[1] - center).length
+        return abs(rs - shape2[2]) <= distance <= rs + shape2[2]
+
+    ptype, (p0, p1), rc = shape2
+    axis = p1 - p0
+    length = axis.length
+    if not length:
+        return None
+    axis /= length
+    v = center - p0
+    t = v.dot(axis)
+    radial = (v - axis * t).length
+
+    # Nearest point of the solid cylinder out of reach
+    da = max(0.0, -t, t - length)
+    dr = max(0.0, radial - rc)
+    if da * da + dr * dr > rs * rs:
+        return False
+    # Cylinder wholly inside the sphere: even its farthest rim point is
+    far = max(abs(t), abs(length - t))
+    if far * far + (radial + rc) ** 2 <= rs * rs:
+        return False
+    # Sphere wholly inside the cylinder
+    if radial + rs <= rc and rs <= t <= length - rs:
+        return False
+    return True
+
+
 def clean_object():
     bpy.ops.object.mode_set(mode='EDIT')
     bpy.ops.mesh.remove_doubles()
@@ -290,6 +425,96 @@ def get_distance(obj1, obj2):
     return (obj1.location - obj2.location).length
 
 
+def neighbor_pairs(objs, cutoff):
+    '''(a, b, distance) for the pairs of objects whose locations are within cutoff,
+    in the same order as itertools.combinations(objs, 2) would give them'''
+    objs = list(objs)
+    tree = mathutils.kdtree.KDTree(len(objs))
+    for i, ob in enumerate(objs):
+        tree.insert(ob.location, i)
+    tree.balance()
+
+    for i, a in enumerate(objs):
+        near = sorted((j, dist) for co, j, dist in tree.find_range(a.location, cutoff) if j > i)
+        for j, dist in near:
+            yield a, objs[j], dist
+
+
+def duplicate_cylinders(objs, quantum=0.0001):
+    '''Cylinders with the same center, axis and radius as an earlier one, to within quantum.
+    Hashed on the rounded values, so near duplicates that round apart are left
+    to the distance check in MolPrintClean'''
+    seen = set()
+    duplicates = []
+    for ob in objs:
+        if ob.get("ptype") != 'Cylinder':
+            continue
+        m = ob.matrix_world.to_3x3()
+        axis = m.col[1].normalized()
+        # Either direction is the same cylinder
+        if next((c for c in axis if abs(c) > quantum), 0) < 0:
+            axis.negate()
+        key = (tuple(round(c / quantum) for c in ob.matrix_world.translation),
+               tuple(round(c / quantum) for c in axis),
+               round(ob.get("radius", 0) * m.col[0].length / quantum))
+        if key in seen:
+            duplicates.append(ob)
+        else:
+            seen.add(key)
+    return duplicates
+
+
+def bound_radius(ob):
+    '''Distance from the object's location to the farthest corner of its bounds'''
+    mw = ob.matrix_world
+    loc = mw.translation
+    return max((mw * Vector(corner) - loc).length for corner in ob.bound_box)
+
+
+def interaction_candidates(objs):
+    '''Pairs of objects whose bounds may touch, except cylinder-cylinder pairs,
+    in the same order as itertools.combinations(objs, 2) would give them.
+    The non-cylinders go in a KD-tree, every object looks up the ones within
+    its own reach plus the largest of theirs'''
+    objs = list(objs)
+    others = [i for i, ob in enumerate(objs) if ob["ptype"] != 'Cylinder']
+    if not others:
+        return []
+    reach = [bound_radius(ob) for ob in objs]
+    max_reach = max(reach[i] for i in others)
+
+    tree = mathutils.kdtree.KDTree(len(others))
+    for i in others:
+        tree.insert(objs[i].location, i)
+    tree.balance()
+
+    pairs = set()
+    for i, a in enumerate(objs):
+        for co, j, dist in tree.find_range(a.location, reach[i] + max_reach):
+            if j != i and dist <= reach[i] + reach[j]:
+                pairs.add((i, j) if i < j else (j, i))
+    return [(objs[i], objs[j]) for i, j in sorted(pairs)]
+
+
+def world_radius(ob):
+    '''Sphere radius in world space from the imported "radius" property, None if unknown'''
+    radius = ob.get("radius", 0)
+    if not radius:
+        return None
+    return radius * max(abs(s) for s in ob.matrix_world.to_scale())
+
+
+def sphere_inside(obj1, obj2, distance, r1, r2, tol=0.0001):
+    '''Analytic isinside() for two spheres with known radii'''
+    if r1 > r2:
+        big_r, small, small_r = r1, obj2, r2
+    else:
+        big_r, small, small_r = r2, obj1, r1
+    if distance + small_r <= big_r + tol:
+        return small
+    return None
+
+
 # This is needed for older pymol vrml versions which added lots of extra primitive spheres
 def isinside(obj1, obj2):
     # This is messy, but works reasonably well
@@ -398,6 +623,8 @@ def updategroups():
     m = 0
     for each in grouplist:
         mat = makeMaterial('mat' + str(m), colors[m])
+        # The material goes on the mesh, a shared one would recolour ungrouped objects too
+        make_single_user(each)
         for ob in each:
             ob.data.materials.clear()
             ob.data.materials.append(mat)
@@ -453,6 +680,7 @@ def bool_carve(obj1, obj2, booltype, modapp=False):
     mymod.solver = 'CARVE'
     mymod.object = obj2
     if modapp:
+        make_single_user([obj1])
         bpy.context.scene.objects.active = obj1
         bpy.ops.object.modifier_apply(modifier='simpmod')
 
@@ -464,6 +692,7 @@ def bool_bmesh(obj1, obj2, booltype, modapp=False):
     mymod.solver = 'BMESH'
     mymod.object = obj2
     if modapp:
+        make_single_user([obj1])
         bpy.context.scene.objects.active = obj1
         bpy.ops.object.modifier_apply(modifier='simpmod')
 
@@ -493,10 +722,16 @@ def getpairs():
         if ob.type == 'MESH' and ob["ptype"] == 'Sphere':
             spheres.append(ob)
 
+    bvh_cache_clear()
+    shapes = {ob.name: primitive_shape(ob) for ob in cylinders + spheres}
     for cyl in cylinders:
         intersect = False
         for sphere in spheres:
-            intersect = bmesh_check_intersect_objects(sphere, cyl)
+            intersect = None
+            if shapes[sphere.name] and shapes[cyl.name]:
+                intersect = primitives_touch(shapes[sphere.name], shapes[cyl.name])
+            if intersect is None:
+                intersect = bmesh_check_intersect_objects(sphere, cyl)
             if intersect:
                 pairs.append([sphere.name, cyl.name])
 
@@ -509,6 +744,8 @@ def joinall():
     # Turn these off so it isn't constantly trying to update
     bpy.context.scene.molprint.interact = False
     bpy.context.scene.molprint.autogroup = False
+    # Everything gets joined or cut from here on
+    make_single_user(bpy.context.scene.objects)
     # TODO: Do all operations on PIP bonds first
     # off-load for now so it is easier to follow
     #do_pip()
@@ -686,26 +923,18 @@ def joinall():
         color_by_radius()
     
     #delete all pins and pin-like objects
+    pinobs = []
     for ob,pin in bpy.context.scene.molprint_lists.pinlist["pinlist"]:
-        bpy.ops.object.select_all(action='DESELECT')
-
-        try:
-            pinob = bpy.data.objects[pin]
-            pinob.select = True
-            bpy.ops.object.delete()
-        except:
+        pinob = bpy.data.objects.get(pin)
+        if pinob is None:
             print("pin missing")
-    
-    #delete everything in the scene that is cube or cone
-    for each in bpy.context.scene.objects:
-        bpy.ops.object.select_all(action='DESELECT')
+        else:
+            pinobs.append(pinob)
 
-        try:
-            if (each["ptype"] == "cone" or each["ptype"] == "cube"):
-                each.select = True
-                bpy.ops.object.delete()
-        except:
-            print("cube missing")
+    #delete everything in the scene that is cube or cone
+    pinobs += [each for each in bpy.context.scene.objects
+               if each.get("ptype") in {"cone", "cube"}]
+    delete_objects(pinobs)
     
     
 
@@ -729,9 +958,7 @@ def intersect_pin(ob):
     
     cube["radius"] = ob["radius"]
     bool_carve(cube, ob, 'INTERSECT', modapp=True)
-    bpy.ops.object.select_all(action='DESELECT')
-    ob.select = True
-    bpy.ops.object.delete()
+    delete_objects([ob])
     # end = time.time()
     # print("Intersect unionization time:",end-start)
     return cube
@@ -914,6 +1141,7 @@ def floormulti(context):
 
     bpy.ops.object.select_all(action='DESELECT')
 
+    make_single_user(multi2)
     for each in multi2:
         each.select = True
         bpy.ops.object.transform_apply(location=False, rotation=True, scale=True)
@@ -943,8 +1171,7 @@ def floormulti(context):
     bpy.ops.object.select_all(action='DESELECT')
 
     # delete the joined copy
-    multi1[0].select = True
-    bpy.ops.object.delete()
+    delete_objects([multi1[0]])
 
     # apply to each original object
     for each in multi2:
@@ -1005,55 +1232,93 @@ def align_vector(obj, vec1, vec2):
     # obj.matrix_world = matrix_translation * matrix_rotate.to_4x4()
 
 
+def cylinder_caps(ob):
+    '''World space (cap centers, unit axis, radius) of a cylinder, from its
+    local bounds and matrix. The mesh is along local Y, as imported'''
+    bb = ob.bound_box
+    xs = [v[0] for v in bb]
+    ys = [v[1] for v in bb]
+    zs = [v[2] for v in bb]
+    cx = (min(xs) + max(xs)) / 2
+    cz = (min(zs) + max(zs)) / 2
+    mw = ob.matrix_world
+    caps = (mw * Vector((cx, max(ys), cz)), mw * Vector((cx, min(ys), cz)))
+    m = mw.to_3x3()
+    axis = (m * Vector((0, 1, 0))).normalized()
+    radius = (max(xs) - min(xs)) / 2 * m.col[0].length
+    return caps, axis, radius
+
+
 def check_split_cyls(obj1, obj2, splitcyllist):
-    '''PyMol splits all cylinders. This joins them together'''
-    bpy.ops.object.select_all(action='DESELECT')
-    bm1 = bmesh_copy_from_object(obj1, transform=True, triangulate=False)
-    bm2 = bmesh_copy_from_object(obj2, transform=True, triangulate=False)
-    matched = False
-    # Must also check face normals
-    for f1 in bm1.faces:
-        if matched:
-            break
-        if len(f1.edges) > 4:
-            f1.normal_flip()
-            for f2 in bm2.faces:
-                if len(f2.edges) > 4:
-                    fnorm1 = (f1.normal * obj1.matrix_world).to_tuple(3)
-                    fnorm2 = (f2.normal * obj2.matrix_world).to_tuple(3)
-                    # convert these to a tuple to allow comparision without rounding issues of vectors
-                    # only need one check. For chimera, needed to drop precision down to 3
-                    if tol(f1.calc_center_median(), f2.calc_center_median()) and fnorm1[1] == fnorm2[1]:
-                        matched = True
-                        splitcyllist.append((obj1, obj2))
-                        break
-    bm1.free()
-    bm2.free()
+    '''PyMol splits all cylinders. Find the halves that share a cap, same axis and radius'''
+    if obj1.get("ptype") != 'Cylinder' or obj2.get("ptype") != 'Cylinder':
+        return splitcyllist
+    joint = geometry.split_cylinder_joint(*(cylinder_caps(obj1) + cylinder_caps(obj2)))
+    if joint is not None:
+        splitcyllist.append((obj1, obj2, Vector(joint)))
     return splitcyllist
 
 
 def merge_split_cyls(splitcyllist):
-    # looked into doing this with bmesh, but wasn't as straightforward :(
-    # print(splitcyllist)
-    for a, b in splitcyllist:
-        # Some models can have odd organization that leads to failures. Try to fix with a quick check:
+    '''Join the halves found by check_split_cyls into one cylinder with bmesh:
+    the shared caps are removed and the rims welded. Pairs that don't close
+    up into a watertight tube are left alone'''
+    removed = []
+    for a, b, cap in splitcyllist:
         try:
-            a.data.materials.clear()
-            b.data.materials.clear()
-        except:
+            a.name, b.name
+        except ReferenceError:
+            continue
+        if b in removed or a in removed:
             continue
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.scene.objects.active = a
-        a.select = True
-        b.select = True
-        bpy.ops.object.join()
-        # Remove interior faces, limited dissolve
-        bpy.context.scene.objects.active = a
-        a.select
-        clean_object()
 
-        bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS')
-        bpy.ops.object.select_all(action='DESELECT')
+        make_single_user([a])
+        to_a = a.matrix_world.inverted()
+        cap_local = to_a * cap
+
+        me = b.data.copy()
+        me.transform(to_a * b.matrix_world)
+
+        bm = bmesh.new()
+        bm.from_mesh(a.data)
+        n_faces = len(bm.faces)
+        bm.from_mesh(me)
+        bpy.data.meshes.remove(me)
+        bm.faces.ensure_lookup_table()
+
+        # b's faces use b's material
+        new_mat = None
+        if b.data.materials and b.data.materials[0] is not None:
+            mat = b.data.materials[0]
+            mats = list(a.data.materials)
+            if mat in mats:
+                index = mats.index(mat)
+            else:
+                index = len(mats)
+                new_mat = mat
+            for f in bm.faces[n_faces:]:
+                f.material_index = index
+
+        caps = [f for f in bm.faces if len(f.verts) > 4 and tol(f.calc_center_median(), cap_local)]
+        bmesh.ops.delete(bm, geom=caps, context=3)  # DEL_ONLYFACES
+        bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=0.001)
+
+        if len(caps) != 2 or not all(e.is_manifold for e in bm.edges):
+            bm.free()
+            continue
+
+        # Keep the origin in the middle like the halves had
+        center = sum((v.co for v in bm.verts), Vector()) / len(bm.verts)
+        bm.transform(Matrix.Translation(-center))
+        if new_mat is not None:
+            a.data.materials.append(new_mat)
+        bm.to_mesh(a.data)
+        bm.free()
+        a.data.update()
+        a.matrix_world = a.matrix_world * Matrix.Translation(center)
+        removed.append(b)
+
+    delete_objects(removed)
 
 
 # Tolerance. Not sure why it needs its own method, but OK.
@@ -23,6 +23,7 @@ import time
 import bpy
 import bmesh
 import itertools
+from collections import Counter
 from bpy.types import Operator
 from bpy.props import (
     StringProperty,
@@ -49,6 +50,9 @@ from bpy_extras.io_utils import (
 
 IOX3DOrientationHelper = orientation_helper_factory("IOX3DOrientationHelper", axis_forward='Z', axis_up='Y')
 
+# See mesh_helpers.merged_objects()
+MERGED_REFUSED = "%d merged objects in the scene, split all their primitives out first (Split Merged)"
+
 
 # From 3D print tools, do I need?
 def clean_float(text):
@@ -73,6 +77,27 @@ class ImportX3DE(Operator, ImportHelper, IOX3DOrientationHelper):
 
     filename_ext = ".x3d"
     filter_glob = StringProperty(default="*.x3d;*.wrl", options={'HIDDEN'})
+    use_cache = BoolProperty(
+        name="Use cache",
+        description="Reuse the atoms and bonds read from an identical file before, "
+                    "the cache keeps the most recently used 256 MB",
+        default=True,
+    )
+    clear_cache = BoolProperty(
+        name="Clear cache",
+        description="Remove all cached files before importing",
+        default=False,
+    )
+    use_profiler = BoolProperty(
+        name="Profile import",
+        description="Write the time and memory of each import phase to a .profile.json next to the file",
+        default=False,
+    )
+    merge = BoolProperty(
+        name="Merge primitives",
+        description="One object for all atoms and one for all bonds, split them out as needed",
+        default=False,
+    )
 
     def execute(self, context):
         from . import import_x3de
@@ -85,10 +110,39 @@ class ImportX3DE(Operator, ImportHelper, IOX3DOrientationHelper):
                                         from_up=self.axis_up,
                                         ).to_4x4()
         keywords["global_matrix"] = global_matrix
-        keywords["PREF_CIRCLE_DIV"] = bpy.context.scene.molprint.prim_detail
+        molprint = bpy.context.scene.molprint
+        keywords["PREF_CIRCLE_DIV"] = molprint.prim_detail
+        if molprint.lod:
+            # In imported units
+            keywords["PREF_CHORD_ERROR"] = molprint.chord_error / molprint.print_scale
+        keywords["report"] = self.report
         bpy.context.scene.molprint.cleaned = False
         return import_x3de.load(context, **keywords)
 
+class MolPrintSplitPrimitives(Operator):
+    """Split the atoms and bonds of the selected faces out of a merged import"""
+    bl_idname = "mesh.molprint_splitprimitives"
+    bl_label = "Split merged primitives"
+    bl_options = {'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return obj is not None and obj.type == 'MESH' and obj.get("merged", False)
+
+    def execute(self, context):
+        obj = context.object
+        if obj.mode == 'EDIT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        layer = obj.data.polygon_layers_int.get("prim_id")
+        if layer is None:
+            return {'CANCELLED'}
+        prim_ids = {layer.data[p.index].value for p in obj.data.polygons if p.select}
+        new_objects = import_x3de.splitPrimitives(context.scene, obj, prim_ids)
+        self.report({'INFO'}, "Split out %d primitives" % len(new_objects))
+        return {'FINISHED'}
+
+
 class MolPrintShowConnectivity(Operator):
     bl_idname = "mesh.molprint_showconnectivity"
     bl_label = "make connectivity cylinders"
@@ -104,8 +158,14 @@ class MolPrintClean(Operator):
     bl_label = "Clean up import mesh"
 
     def execute(self, context):
+        merged = mesh_helpers.merged_objects(bpy.context.scene.objects)
+        if merged:
+            self.report({'ERROR'}, MERGED_REFUSED % len(merged))
+            return {'CANCELLED'}
+
         delete_list = []
         splitcyllist = []
+        merge_split = bpy.context.scene.molprint.merge_split
         # Remove all non-mesh objects first so they are out of the way
         for obj in bpy.context.scene.objects:
             obj["conelist"] = ['None']
@@ -117,16 +177,33 @@ class MolPrintClean(Operator):
             if obj.type != 'MESH':
                 bpy.context.scene.objects.unlink(obj)
 
-        # Make all linked objects single user: Jmol issue
-        bpy.ops.object.make_single_user(type='ALL', object=True, obdata=True)
-        # Generate a list of pairs of existing objects to do comparisons against
-        objlist = itertools.combinations(bpy.context.scene.objects, 2)
+        # Linked duplicates (Jmol USE) stay shared until an edit needs its own
+        # mesh, see mesh_helpers.make_single_user()
+
+        # Exact and near duplicate cylinders in one pass, counted per exporter
+        duplicates = mesh_helpers.duplicate_cylinders(bpy.context.scene.objects)
+        if duplicates:
+            exporters = Counter(obj.get("exporter", 'unknown') for obj in duplicates)
+            mesh_helpers.delete_objects(duplicates)
+            counts = ", ".join("%s: %d" % item for item in sorted(exporters.items()))
+            print("Removed duplicate cylinders", counts)
+            self.report({'INFO'}, "Removed duplicate cylinders " + counts)
+
+        # World radii of the spheres, read once instead of their bounds per pair
+        radii = {obj.name: mesh_helpers.world_radius(obj)
+                 for obj in bpy.context.scene.objects if obj['ptype'] == 'Sphere'}
+        # Pairs of existing objects close enough for any of the checks below
+        objlist = mesh_helpers.neighbor_pairs(bpy.context.scene.objects, 2)
         # TODO: Make this whole thing more pythonic
-        for (a, b) in objlist:
-            distance = mesh_helpers.get_distance(a, b)
+        for (a, b, distance) in objlist:
             # Sphere check for internal objects, old pymol files require such a high distance check
             if a['ptype'] and b['ptype'] == 'Sphere' and distance < 0.3:
-                inside = mesh_helpers.isinside(a, b)
+                ra = radii.get(a.name)
+                rb = radii.get(b.name)
+                if ra is not None and rb is not None:
+                    inside = mesh_helpers.sphere_inside(a, b, distance, ra, rb)
+                else:
+                    inside = mesh_helpers.isinside(a, b)
                 if inside:
                     delete_list.append(inside)
             # Remove duplicate cylinders that can cause issues
@@ -134,22 +211,14 @@ class MolPrintClean(Operator):
                 delete_list.append(b)
                 continue
             # Clyinder check for 'split' cylinder bonds
-            if a['ptype'] and b['ptype'] == 'Cylinder' and distance < 2:
+            if merge_split and a['ptype'] and b['ptype'] == 'Cylinder' and distance < 2:
                 splitcyllist = mesh_helpers.check_split_cyls(a, b, splitcyllist)
                 # Delete everything that is in the delete list if it still exists
-        # TODO: Make this more pythonic
-        for each in delete_list:
-            try:
-                bpy.ops.object.select_all(action='DESELECT')
-                each.select = True
-                bpy.ops.object.delete()
-            except:
-                continue
+        mesh_helpers.delete_objects(delete_list)
 
-        # This is causing unexpected issues. Removing for now
         # Join split cylinders if they exist
-        # if len(splitcyllist) > 0:
-        #    mesh_helpers.merge_split_cyls(splitcyllist)
+        if len(splitcyllist) > 0:
+            mesh_helpers.merge_split_cyls(splitcyllist)
 
         bpy.context.scene.molprint.cleaned = True
         # reset any pin groups
@@ -177,15 +246,18 @@ class MolPrintGetInteractions(Operator):
     def getinteractions(context):
         interactionlist = []
         # Build a complete list of interactions between objects to speed up joining
-        # Uses a 2 unit distance cutoff. This may impact long generated struts?
-        objlist = itertools.combinations(bpy.context.scene.objects, 2)
+        # Candidates are pairs whose bounds may touch, struts of any length included
+        mesh_helpers.bvh_cache_clear()
+        # Untouched spheres and cylinders are tested in closed form, the rest by their meshes
+        shapes = {obj.name: mesh_helpers.primitive_shape(obj) for obj in bpy.context.scene.objects}
+        objlist = mesh_helpers.interaction_candidates(bpy.context.scene.objects)
         for each in objlist:
-            # Ignore cylinder-cylinder interactions
-            if (each[0]["ptype"] == 'Cylinder') and (each[1]["ptype"] == 'Cylinder'):
-                continue
-            distance = mesh_helpers.get_distance(each[0], each[1])
-            intersect = False
-            if distance < 2:
+            intersect = None
+            shape0 = shapes[each[0].name]
+            shape1 = shapes[each[1].name]
+            if shape0 and shape1:
+                intersect = mesh_helpers.primitives_touch(shape0, shape1)
+            if intersect is None:
                 intersect = mesh_helpers.bmesh_check_intersect_objects(each[0], each[1])
             if intersect:
                 if each[0]["ptype"] == 'Sphere':
@@ -193,10 +265,17 @@ class MolPrintGetInteractions(Operator):
                 if each[0]["ptype"] == 'Cylinder':
                     interactionlist.append([each[1].name, each[0].name])
 
-        return interactionlist
+        return interactionlist, len(objlist)
 
     def execute(self, context):
-        ial = self.getinteractions(context)
+        merged = mesh_helpers.merged_objects(bpy.context.scene.objects)
+        if merged:
+            self.report({'ERROR'}, MERGED_REFUSED % len(merged))
+            return {'CANCELLED'}
+        ial, candidates = self.getinteractions(context)
+        message = "Interactions: %d candidate pairs, %d contacts" % (candidates, len(ial))
+        print(message)
+        self.report({'INFO'}, message)
         bpy.context.scene.molprint_lists.internames["pairs"] = ial
         bpy.ops.mesh.molprint_objinteract()
         bpy.context.scene.molprint.interact = True
@@ -301,6 +380,10 @@ class MolPrintPinJoin(Operator):
             return False
 
     def execute(self, context):
+        merged = mesh_helpers.merged_objects(bpy.context.scene.objects)
+        if merged:
+            self.report({'ERROR'}, MERGED_REFUSED % len(merged))
+            return {'CANCELLED'}
         mesh_helpers.joinall()
         bpy.context.scene.molprint.joined = True
         return {'FINISHED'}
@@ -471,6 +554,10 @@ class MolPrintCPKSplit(Operator):
         return True if bpy.context.scene.molprint.cleaned else False
 
     def execute(self, context):
+        merged = mesh_helpers.merged_objects(bpy.context.scene.objects)
+        if merged:
+            self.report({'ERROR'}, MERGED_REFUSED % len(merged))
+            return {'CANCELLED'}
         starttime = time.time()
         bpy.context.scene.molprint.interact = False
         bpy.context.scene.molprint.autogroup = False
@@ -489,6 +576,7 @@ class MolPrintCPKSplit(Operator):
         dummy2 = bpy.context.scene.objects.active
         dummy2["ptype"] = "CPKcyl"
         # Build all the cylinders for boolean operations
+        mesh_helpers.bvh_cache_clear()
         for a, b in objlist:
             if a['radius'] == b['radius']:
                 continue
@@ -499,16 +587,15 @@ class MolPrintCPKSplit(Operator):
                 mesh_helpers.cpkcyl(a, b, dummy1, dummy2)
                 # mesh_helpers.cpkcyl(b,a,dummy2,dummy1)
         # Apply all modifiers
+        mesh_helpers.make_single_user(bpy.context.scene.objects)
         for each in bpy.context.scene.objects:
             if each.modifiers:
                 for modifier in each.modifiers:
                     bpy.context.scene.objects.active = each
                     bpy.ops.object.modifier_apply(modifier=modifier.name)
         # Delete all extra objects
-        for each in bpy.context.scene.objects:
-            if each['ptype'] == "CPKcyl":
-                each.select = True
-                bpy.ops.object.delete()
+        mesh_helpers.delete_objects([each for each in bpy.context.scene.objects
+                                     if each['ptype'] == "CPKcyl"])
 
         # Create list that contains all atoms by radius.
         unique = mesh_helpers.radius_sort(bpy.context.scene.objects)
@@ -522,7 +609,8 @@ class MolPrintCPKSplit(Operator):
             bpy.ops.object.join()
             bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS')
         # Do "intersect" unionization, may not be necessary in all cases, but is in some
-        for ob in bpy.context.scene.objects:
+        joined = list(bpy.context.scene.objects)
+        for ob in joined:
             bpy.ops.mesh.primitive_cube_add(location=ob.location)
             bpy.ops.transform.resize(value=(30, 30, 30))
             cube = bpy.context.selected_objects[0]
@@ -531,9 +619,7 @@ class MolPrintCPKSplit(Operator):
             mat = ob.data.materials[0]
             cube.data.materials.append(mat)
             mesh_helpers.bool_carve(cube, ob, 'INTERSECT', modapp=True)
-            bpy.ops.object.select_all(action='DESELECT')
-            ob.select = True
-            bpy.ops.object.delete()
+        mesh_helpers.delete_objects(joined)
 
         print("CPK: ", time.time() - starttime)
         return {'FINISHED'}
@@ -609,16 +695,10 @@ class MolPrintPIP(Operator):
         cyl.scale = ((1.08, 1.02, 1.08)) #was 1.12, 1.02, 1.12, too loose on MK3, 1.05 too tight
         mesh_helpers.bool_carve(sphere, cyl, "DIFFERENCE", modapp=True)
         cyl.scale = ((1.0, 1.0, 1.0))
-        #delete pin
-        bpy.ops.object.select_all(action='DESELECT')
-        pin.select = True
-        bpy.ops.object.delete()
-        #delete cone
-        bpy.ops.object.select_all(action='DESELECT')
+        #delete pin and cone
         conename = bpy.context.scene.molprint_lists.splitlist["conelist"][0][1]
         cone = bpy.data.objects[conename]
-        cone.select = True
-        bpy.ops.object.delete()
+        mesh_helpers.delete_objects([pin, cone])
         #reset conelist
         bpy.context.scene.molprint_lists.splitlist["conelist"] = []
 
@@ -692,10 +772,7 @@ class MolPrintMakeDouble(Operator):
                 each.select = True
                 bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS')
                 # each.rotation_euler = rot
-                each.select = False
-                newbond.select = True
-                bpy.ops.object.delete()
-                each.select = True
+                mesh_helpers.delete_objects([newbond])
         if autostate:
             auto = True
 
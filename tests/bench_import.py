@@ -0,0 +1,66 @@
+# <pep8 compliant>
+
+"""
+Time ball and stick imports of growing size with the import profiler.
+Needs blender, the add-on does not have to be installed:
+    blender --background --factory-startup --python tests/bench_import.py -- [primitives ...]
+Defaults to 1000 10000 50000 primitives (half atoms, half bonds), each
+imported as separate objects and merged. Prints the profile of every run.
+"""
+
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+import bpy
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, TESTS_DIR)
+sys.path.insert(0, os.path.dirname(ADDON_DIR))
+
+from test_vrml_tokenize import make_ball_and_stick
+
+import_x3de = importlib.import_module(os.path.basename(ADDON_DIR) + ".import_x3de")
+
+
+def clear_scene():
+    for ob in list(bpy.data.objects):
+        bpy.data.objects.remove(ob, do_unlink=True)
+    for me in list(bpy.data.meshes):
+        if not me.users:
+            bpy.data.meshes.remove(me)
+
+
+def run(path, merge):
+    clear_scene()
+    import_x3de.load(bpy.context, path, use_cache=False, use_profiler=True, merge=merge)
+    with open(path + '.profile.json') as f:
+        report = json.load(f)
+    os.remove(path + '.profile.json')
+    return report
+
+
+def main(args):
+    counts = [int(a) for a in args] or [1000, 10000, 50000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            path = os.path.join(tmp, "bench_%d.wrl" % count)
+            with open(path, 'w') as f:
+                f.write(make_ball_and_stick(count // 2))
+
+            for merge in (False, True):
+                report = run(path, merge)
+                print("%d primitives%s: %.2f s, %d objects, %s path" % (
+                      count, " merged" if merge else "", report['total_seconds'],
+                      report.get('objects', 0), report.get('import_path', '?')))
+                for phase in report['phases']:
+                    print("    %-14s %8.3f s %6d calls" % (phase['name'], phase['seconds'], phase['calls']))
+    clear_scene()
+
+
+if __name__ == '__main__':
+    argv = sys.argv
+    main(argv[argv.index('--') + 1:] if '--' in argv else [])
@@ -0,0 +1,130 @@
+# <pep8 compliant>
+
+"""
+vrmlFormat() as it was before vrml_tokenize(), kept as the reference
+for the tokenizer parity check. Do not use it in the add-on.
+"""
+
+from nobpy import load_parser
+
+vrml_split_fields = load_parser().vrml_split_fields
+
+
+def vrmlFormat(data):
+    """
+    Keep this as a valid vrml file, but format in a way we can predict.
+    """
+    # Strip all commends - # not in strings - warning multiline strings are ignored.
+    def strip_comment(l):
+        #l = ' '.join(l.split())
+        l = l.strip()
+
+        if l.startswith('#'):
+            return ''
+
+        i = l.find('#')
+
+        if i == -1:
+            return l
+
+        # Most cases accounted for! if we have a comment at the end of the line do this...
+        #j = l.find('url "')
+        j = l.find('"')
+
+        if j == -1:  # simple no strings
+            return l[:i].strip()
+
+        q = False
+        for i, c in enumerate(l):
+            if c == '"':
+                q = not q  # invert
+
+            elif c == '#':
+                if q is False:
+                    return l[:i - 1]
+
+        return l
+
+    data = '\n'.join([strip_comment(l) for l in data.split('\n')])  # remove all whitespace
+
+    EXTRACT_STRINGS = True  # only needed when strings or filesnames containe ,[]{} chars :/
+
+    if EXTRACT_STRINGS:
+
+        # We need this so we can detect URL's
+        data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
+
+        string_ls = []
+
+        #search = 'url "'
+        search = '"'
+
+        ok = True
+        last_i = 0
+        while ok:
+            ok = False
+            i = data.find(search, last_i)
+            if i != -1:
+
+                start = i + len(search)  # first char after end of search
+                end = data.find('"', start)
+                if end != -1:
+                    item = data[start:end]
+                    string_ls.append(item)
+                    data = data[:start] + data[end:]
+                    ok = True  # keep looking
+
+                    last_i = (end - len(item)) + 1
+                    # print(last_i, item, '|' + data[last_i] + '|')
+
+    # done with messy extracting strings part
+
+    # Bad, dont take strings into account
+    '''
+    data = data.replace('#', '\n#')
+    data = '\n'.join([ll for l in data.split('\n') for ll in (l.strip(),) if not ll.startswith('#')]) # remove all whitespace
+    '''
+    data = data.replace('{', '\n{\n')
+    data = data.replace('}', '\n}\n')
+    data = data.replace('[', '\n[\n')
+    data = data.replace(']', '\n]\n')
+    data = data.replace(',', ' , ')  # make sure comma's separate
+
+    # We need to write one property (field) per line only, otherwise we fail later to detect correctly new nodes.
+    # See T45195 for details.
+    data = '\n'.join([' '.join(value) for l in data.split('\n') for value in vrml_split_fields(l.split())])
+
+    if EXTRACT_STRINGS:
+        # add strings back in
+
+        search = '"'  # fill in these empty strings
+
+        ok = True
+        last_i = 0
+        while ok:
+            ok = False
+            i = data.find(search + '"', last_i)
+            # print(i)
+            if i != -1:
+                start = i + len(search)  # first char after end of search
+                item = string_ls.pop(0)
+                # print(item)
+                data = data[:start] + item + data[start:]
+
+                last_i = start + len(item) + 1
+
+                ok = True
+
+    # More annoying obscure cases where USE or DEF are placed on a newline
+    # data = data.replace('\nDEF ', ' DEF ')
+    # data = data.replace('\nUSE ', ' USE ')
+
+    data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
+
+    # Better to parse the file accounting for multiline arrays
+    '''
+    data = data.replace(',\n', ' , ') # remove line endings with commas
+    data = data.replace(']', '\n]\n') # very very annoying - but some comma's are at the end of the list, must run this again.
+    '''
+
+    return [l for l in data.split('\n') if l]
@@ -0,0 +1,44 @@
+# <pep8 compliant>
+
+"""
+Load the part of import_x3de.py above the bpy imports, the VRML/X3D
+parsing, and the add-on modules that never import bpy, so they can be
+checked with a plain python without blender.
+"""
+
+import importlib.util
+import os
+import types
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLENDER_MARKER = "# NO BLENDER CODE ABOVE THIS LINE."
+
+_parser = None
+
+
+def load_parser():
+    global _parser
+
+    if _parser is None:
+        path = os.path.join(ADDON_DIR, "import_x3de.py")
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+        source = source[:source.index(BLENDER_MARKER)]
+
+        _parser = types.ModuleType("import_x3de_nobpy")
+        _parser.__file__ = path
+        exec(compile(source, path, 'exec'), _parser.__dict__)
+
+    return _parser
+
+
+def load_module(name):
+    """
+    An add-on module that needs no blender, eg. geometry, loaded by path
+    since the add-on package itself imports bpy.
+    """
+    path = os.path.join(ADDON_DIR, name + ".py")
+    spec = importlib.util.spec_from_file_location("molprint_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
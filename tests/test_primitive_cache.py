@@ -0,0 +1,61 @@
+# <pep8 compliant>
+
+"""
+The on disk primitive table cache stays under its size cap.
+"""
+
+import os
+import tempfile
+import unittest
+
+from nobpy import load_parser
+
+x3d = load_parser()
+
+
+class PrimitiveCacheEvict(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, key, size, mtime):
+        path = os.path.join(self.cache_dir, key + x3d.PRIMITIVE_CACHE_EXT)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        os.utime(path, (mtime, mtime))
+
+    def keys(self):
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(self.cache_dir))
+
+    def test_least_recently_used_first(self):
+        self.add('a', 100, 1000)
+        self.add('b', 100, 3000)
+        self.add('c', 100, 2000)
+        x3d.primitive_cache_evict(self.cache_dir, 200)
+        self.assertEqual(self.keys(), ['b', 'c'])
+
+        x3d.primitive_cache_evict(self.cache_dir, 99)
+        self.assertEqual(self.keys(), [])
+
+    def test_under_cap_untouched(self):
+        self.add('a', 100, 1000)
+        self.add('b', 100, 2000)
+        x3d.primitive_cache_evict(self.cache_dir, 200)
+        self.assertEqual(self.keys(), ['a', 'b'])
+
+    def test_load_marks_use(self):
+        self.add('a', 0, 1000)
+        self.add('b', 100, 2000)
+        self.add('c', 100, 3000)
+        # empty file, no table but still the most recent use
+        self.assertIsNone(x3d.primitive_cache_load(self.cache_dir, 'a'))
+        x3d.primitive_cache_evict(self.cache_dir, 100)
+        self.assertEqual(self.keys(), ['a', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
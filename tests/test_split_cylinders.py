@@ -0,0 +1,66 @@
+# <pep8 compliant>
+
+"""
+Matching the two halves PyMOL splits a bond into, geometry.split_cylinder_joint().
+"""
+
+import math
+import unittest
+
+from nobpy import load_module
+
+geometry = load_module("geometry")
+
+Y = (0.0, 1.0, 0.0)
+MINUS_Y = (0.0, -1.0, 0.0)
+
+
+def half(y0, y1, axis=Y, radius=0.1, x=0.0):
+    """(caps, axis, radius) of a cylinder along Y from y0 to y1, as cylinder_caps() gives"""
+    top, bottom = (x, max(y0, y1), 0.0), (x, min(y0, y1), 0.0)
+    if axis[1] < 0:
+        top, bottom = bottom, top
+    return (top, bottom), axis, radius
+
+
+def joint(h1, h2):
+    return geometry.split_cylinder_joint(*(h1 + h2))
+
+
+class SplitCylinderJoint(unittest.TestCase):
+
+    def assertJoint(self, result, expected):
+        self.assertIsNotNone(result)
+        for a, b in zip(result, expected):
+            self.assertAlmostEqual(a, b)
+
+    def test_parallel_halves(self):
+        self.assertJoint(joint(half(0, 1), half(1, 2)), (0, 1, 0))
+        # either order
+        self.assertJoint(joint(half(1, 2), half(0, 1)), (0, 1, 0))
+
+    def test_anti_parallel_halves(self):
+        self.assertJoint(joint(half(0, 1), half(1, 2, MINUS_Y)), (0, 1, 0))
+
+    def test_not_parallel(self):
+        a = math.radians(5)
+        tilted = (math.sin(a), math.cos(a), 0.0)
+        self.assertIsNone(joint(half(0, 1), half(1, 2, tilted)))
+        a = math.radians(1)
+        tilted = (math.sin(a), math.cos(a), 0.0)
+        self.assertJoint(joint(half(0, 1), half(1, 2, tilted)), (0, 1, 0))
+
+    def test_radius_tolerance(self):
+        self.assertJoint(joint(half(0, 1, radius=0.1), half(1, 2, radius=0.105)), (0, 1, 0))
+        self.assertIsNone(joint(half(0, 1, radius=0.1), half(1, 2, radius=0.12)))
+
+    def test_cap_distance(self):
+        # caps closer than tol() meet halfway
+        self.assertJoint(joint(half(0, 1), half(1.008, 2)), (0, 1.004, 0))
+        self.assertIsNone(joint(half(0, 1), half(1.012, 2)))
+        # side by side, the caps are level but apart
+        self.assertIsNone(joint(half(0, 1), half(0, 1, x=0.5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
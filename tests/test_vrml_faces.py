@@ -0,0 +1,79 @@
+# <pep8 compliant>
+
+"""
+IndexedFaceSet points and faces, the part of importMesh_IndexedFaceSet()
+before the blender mesh is made.
+"""
+
+import os
+import tempfile
+import unittest
+from array import array
+
+from nobpy import load_parser
+
+x3d = load_parser()
+
+# Integer only points parse as an 'i' array. Four used points out of thirty
+# make the importer cull them.
+INT_POINTS = '''#VRML V2.0 utf8
+Shape {
+  geometry IndexedFaceSet {
+    coord Coordinate { point [ 0 0 0, 1 0 0, 1 1 0, 0 1 0,
+                               %s ] }
+    coordIndex [ 0, 1, 2, 3, -1 ]
+  }
+}
+''' % ', '.join('%d %d %d' % (i, i, i) for i in range(4, 30))
+
+
+def find_spec(node, spec):
+    if node.getSpec() == spec:
+        return node
+    for child in node.getRealNode().children:
+        found = find_spec(child, spec)
+        if found:
+            return found
+    return None
+
+
+def parse_face_set(text):
+    fd, path = tempfile.mkstemp(suffix='.wrl')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        root, msg = x3d.vrml_parse(path)
+    finally:
+        os.remove(path)
+
+    assert root is not None, msg
+    geom = find_spec(root, 'IndexedFaceSet')
+    coord = geom.getChildBySpec('Coordinate')
+    points = coord.getFieldAsArray('point', 0, [])
+    index = geom.getFieldAsArray('coordIndex', 0, [])
+    return points, index
+
+
+class VrmlIndexFaces(unittest.TestCase):
+
+    def test_int_points_culled(self):
+        points, index = parse_face_set(INT_POINTS)
+        self.assertEqual(points.typecode, 'i')
+
+        points, faces, uncull = x3d.vrml_index_faces(points, index, True)
+        self.assertEqual(points.typecode, 'f')
+        self.assertEqual(list(points), [0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0])
+        self.assertEqual(faces, [[0, 1, 2, 3]])
+        self.assertEqual(uncull, [0, 1, 2, 3])
+
+    def test_int_points_not_culled(self):
+        points, faces, uncull = x3d.vrml_index_faces(
+            array('i', [0, 0, 0, 1, 0, 0, 1, 1, 0]), array('i', [0, 1, 2, -1, 2, 1, 0]), False)
+        self.assertEqual(points.typecode, 'f')
+        self.assertEqual(len(points), 9)
+        self.assertEqual(faces, [[2, 1, 0], [0, 1, 2]])
+        self.assertIsNone(uncull)
+
+
+if __name__ == '__main__':
+    unittest.main()
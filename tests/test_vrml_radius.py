@@ -0,0 +1,64 @@
+# <pep8 compliant>
+
+"""
+The "radius" property of Sphere and Cylinder objects must not depend on
+which import path read the file: the file's radius, 0 when it has none.
+"""
+
+import os
+import tempfile
+import unittest
+
+from nobpy import load_parser
+
+x3d = load_parser()
+
+SHAPES = '''#VRML V2.0 utf8
+Transform { translation 0 0 0 children Shape { geometry Sphere { } } }
+Transform { translation 1 0 0 children Shape { geometry Sphere { radius 0.3 } } }
+Transform { translation 2 0 0 children Shape { geometry Cylinder { height 2 } } }
+Transform { translation 3 0 0 children Shape { geometry Cylinder { radius 0.1 height 2 } } }
+'''
+
+EXPECTED = [0, 0.3, 0, 0.1]
+
+
+def find_specs(node, specs, found):
+    if node.getSpec() in specs:
+        found.append(node)
+    for child in node.getRealNode().children:
+        find_specs(child, specs, found)
+    return found
+
+
+class VrmlRadiusProperty(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.wrl')
+        with os.fdopen(fd, 'w') as f:
+            f.write(SHAPES)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_primitive_table(self):
+        table = x3d.vrml_read_primitives(x3d.vrml_read(self.path))
+        self.assertIsNotNone(table)
+        radii = [x3d.primitive_radius_property(table.radii[j], table.flags[j])
+                 for j in range(len(table))]
+        self.assertEqual([round(r, 6) for r in radii], EXPECTED)
+
+    def test_generic(self):
+        root, msg = x3d.vrml_parse(self.path)
+        self.assertIsNotNone(root, msg)
+        radii = []
+        for geom in find_specs(root, {'Sphere', 'Cylinder'}, []):
+            default = 0.5 if geom.getSpec() == 'Sphere' else 1.0
+            radius, prop = x3d.vrml_geometry_radius(geom, [], default)
+            self.assertEqual(radius, prop if prop else default)
+            radii.append(prop)
+        self.assertEqual([round(r, 6) for r in radii], EXPECTED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# <pep8 compliant>
+
+"""
+vrml_tokenize() must give the same lines as the old vrmlFormat().
+
+Run from this directory, the add-on __init__.py above needs blender:
+    python -m pytest -q
+Run as a script to also time both on synthetic files, or on the given files:
+    python test_vrml_tokenize.py [file.wrl ...]
+"""
+
+import sys
+import time
+import unittest
+
+from nobpy import load_parser
+from legacy_vrml import vrmlFormat as legacy_vrmlFormat
+
+x3d = load_parser()
+
+EDGE_CASES = '''#VRML V2.0 utf8
+# header comment
+PROTO Atom [ field SFFloat r 1.0 exposedField SFColor c 1 0 0 ] {
+  Transform { children Shape { geometry Sphere { radius IS r } } }
+}
+DEF Root Transform {
+  translation 1.0 -2.5 3e-2   # trailing comment
+  children [
+    Shape {
+      appearance Appearance {
+        material DEF Mat Material { diffuseColor 0.5 0.5 0.5 shininess 0.2 }
+        texture ImageTexture { url "tex #1 [a], {b}.png" repeatS FALSE }
+      }
+      geometry IndexedFaceSet {
+        coord Coordinate { point [ 0 0 0, 1 0 0,
+                                   1 1 0,0 1 0 ] }
+        coordIndex [ 0, 1, 2, -1,
+                     0, 2, 3, -1 ]
+      }
+    }
+    Shape { appearance Appearance { material USE Mat } geometry Cylinder { radius 0.2 height 2 } }
+    Atom { r 0.4 c 0 0 1 }
+  ]
+}
+WorldInfo { title "A   title, with  spaces" info [ "one" "two # not a comment" ] }
+Viewpoint { description "view" position 0 0 10 }
+Anchor { url"a.wrl","b.wrl" ,"c.wrl", parameter [ "x",y ,z,"w"] }
+'''
+
+
+def make_ball_and_stick(n):
+    """PyMOL style file, n sphere and n cylinder transforms with named materials."""
+    parts = ['#VRML V2.0 utf8\n']
+    for i in range(n):
+        x, y, z = i * 0.1, i * 0.2, i * 0.3
+        parts.append(
+            'Transform {\n'
+            ' translation %.4f %.4f %.4f\n'
+            ' children Shape {\n'
+            '  appearance Appearance { material Material { diffuseColor 0.2 0.3 0.4 } }\n'
+            '  geometry Sphere { radius 0.25 }\n'
+            ' }\n'
+            '}\n'
+            'DEF "atom_%d" Transform {\n'
+            ' translation %.4f %.4f %.4f\n'
+            ' rotation 0 0 1 1.5708\n'
+            ' children Shape { geometry Cylinder { radius 0.1 height 1.2 } }\n'
+            '}\n' % (x, y, z, i, z, y, x))
+    return ''.join(parts)
+
+
+def make_surface(n):
+    """One IndexedFaceSet with n points, comma separated across lines."""
+    points = ',\n'.join('%d.5 %d %d.25' % (i, i % 7, i % 13) for i in range(n))
+    index = ',\n'.join('%d, %d, %d, -1' % (i, i + 1, i + 2) for i in range(n - 2))
+    return ('#VRML V2.0 utf8\nShape {\n geometry IndexedFaceSet {\n'
+            '  coord Coordinate { point [\n%s\n] }\n'
+            '  coordIndex [\n%s\n]\n }\n}\n' % (points, index))
+
+
+class VrmlTokenizeParity(unittest.TestCase):
+
+    def assertParity(self, data):
+        self.assertEqual(x3d.vrmlFormat(data), legacy_vrmlFormat(data))
+
+    def test_edge_cases(self):
+        self.assertParity(EDGE_CASES)
+
+    def test_ball_and_stick(self):
+        self.assertParity(make_ball_and_stick(50))
+
+    def test_surface(self):
+        self.assertParity(make_surface(200))
+
+    def test_chunked(self):
+        # Tokens cut by a chunk end are carried over to the next chunk
+        data = EDGE_CASES + make_ball_and_stick(10) + make_surface(30)
+        expected = legacy_vrmlFormat(data)
+        for size in (1, 2, 3, 7, 64, 1000):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(list(x3d.vrml_tokenize(chunks)), expected, size)
+
+
+def benchmark(name, data):
+    t = time.perf_counter()
+    new = x3d.vrmlFormat(data)
+    t_new = time.perf_counter() - t
+
+    t = time.perf_counter()
+    old = legacy_vrmlFormat(data)
+    t_old = time.perf_counter() - t
+
+    print("%s: %.1f KB, %d lines, vrmlFormat %.3f s, old %.3f s, %s" % (
+          name, len(data) / 1024, len(new), t_new, t_old,
+          "same lines" if new == old else "DIFFERENT LINES"))
+
+
+def main(args):
+    if args:
+        for path in args:
+            with open(path, encoding='utf-8', errors='surrogateescape') as f:
+                benchmark(path, f.read())
+    else:
+        benchmark("ball and stick", make_ball_and_stick(2000))
+        benchmark("surface", make_surface(20000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -51,7 +51,18 @@ class MolPrintToolBar1(MolPrintToolBar, Panel):
         rowsub.label("Primitive divisions")
         rowsub.prop(molprint, "prim_detail", text="")
         rowsub = layout.row(align=True)
+        rowsub.prop(molprint, "lod")
+        if molprint.lod:
+            rowsub = layout.row(align=True)
+            rowsub.prop(molprint, "chord_error")
+            rowsub = layout.row(align=True)
+            rowsub.prop(molprint, "print_scale")
+        rowsub = layout.row(align=True)
+        rowsub.prop(molprint, "merge_split")
+        rowsub = layout.row(align=True)
         rowsub.operator("mesh.molprint_clean", text="Clean Scene")
+        rowsub = layout.row(align=True)
+        rowsub.operator("mesh.molprint_splitprimitives", text="Split Merged")
         # rowsub = layout.row(align=True)
         # rowsub.operator("mesh.molprint_clean", text="Clean Scene")
 